@@ -1,16 +1,26 @@
 import rs_data
 import rs_ranking
 import sys
+from rs_config import cfg
 
 def main():
-   skipEnter = None if len(sys.argv) <= 1 else sys.argv[1]
-   forceTDA = None if len(sys.argv) <= 2 else sys.argv[2]
-   api_key = None if len(sys.argv) <= 3 else sys.argv[3]
+   args = [arg for arg in sys.argv if not arg.startswith("--")]
+   resume = "--resume" in sys.argv
+   profile = "--profile" in sys.argv
+   stream = "--stream" in sys.argv or cfg("STREAM_RANKING")
+   skipEnter = None if len(args) <= 1 else args[1]
+   forceTDA = None if len(args) <= 2 else args[2]
+   api_key = None if len(args) <= 3 else args[3]
+   if stream:
+      # the closes go straight from the loaders to the ranking, the price history isn't written
+      price_data = rs_data.stream_prices(rs_ranking.HISTORY, forceTDA=="true", api_key or rs_data.API_KEY)
+      rs_ranking.main(skipEnter=="true", profile=profile, price_data=price_data)
+      return
    if api_key:
-      rs_data.main(forceTDA=="true", api_key)
+      rs_data.main(forceTDA=="true", api_key, resume=resume)
    else:
-      rs_data.main(forceTDA=="true")
-   rs_ranking.main(skipEnter=="true")
+      rs_data.main(forceTDA=="true", resume=resume)
+   rs_ranking.main(skipEnter=="true", profile=profile)
 
 if __name__ == "__main__":
    main()
\ No newline at end of file
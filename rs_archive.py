@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Archive of the daily rankings, one folder per table and day with one .npy file per column:
+
+    output/archive/stocks/date=2024-05-17/ticker.npy, rank.npy, relative_strength.npy, ...
+    output/archive/industries/date=2024-05-17/...
+
+Rows are sorted by the key column (ticker or industry), so a lookup is a binary search in one small file per day.
+columns.json has the dtype and data offset of every column, so single values are read with one seek.
+
+    python rs_archive.py AAPL
+    python rs_archive.py --table industries "Semiconductors" --from 2024-01-01
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import date
+import numpy as np
+import pandas as pd
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+ARCHIVE_DIR = os.path.join(DIR, "output", "archive")
+META_FILE = "columns.json"
+PARTITION_PREFIX = "date="
+HISTORY_COLUMNS = ("Rank", "Relative Strength", "Percentile", "1 Month Ago", "3 Months Ago", "6 Months Ago")
+
+def column_file(column):
+    return column.lower().replace(" ", "_") + ".npy"
+
+def write_partition(df, table, key, day = None, path = None):
+    """Writes one day of a ranking table sorted by key. Running again on the same day replaces that day, older days are never touched."""
+    day = day or date.today()
+    partition = os.path.join(path or ARCHIVE_DIR, table, f'{PARTITION_PREFIX}{day.isoformat()}')
+    df = df.sort_values(key, kind="mergesort")
+    tmp_partition = partition + ".tmp"
+    if os.path.exists(tmp_partition):
+        shutil.rmtree(tmp_partition)
+    os.makedirs(tmp_partition)
+    meta = {"key": key, "rows": len(df), "columns": list(df.columns), "dtypes": {}, "offsets": {}}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            # fixed width unicode, so the files can be read without pickle
+            values = values.astype(str)
+        file = os.path.join(tmp_partition, column_file(column))
+        np.save(file, values)
+        meta["dtypes"][column] = values.dtype.str
+        meta["offsets"][column] = data_offset(file)
+    with open(os.path.join(tmp_partition, META_FILE), "w", encoding="utf8") as fp:
+        json.dump(meta, fp, ensure_ascii=False)
+    if os.path.exists(partition):
+        shutil.rmtree(partition)
+    os.rename(tmp_partition, partition)
+
+def partitions(table, start = None, end = None, path = None):
+    """(day, folder) of the partitions of table from start to end (both included), oldest first. Other days aren't opened at all."""
+    table_dir = os.path.join(path or ARCHIVE_DIR, table)
+    if not os.path.exists(table_dir):
+        return []
+    result = []
+    for name in os.listdir(table_dir):
+        if not name.startswith(PARTITION_PREFIX) or name.endswith(".tmp"):
+            continue
+        day = date.fromisoformat(name[len(PARTITION_PREFIX):])
+        if (start and day < start) or (end and day > end):
+            continue
+        result.append((day, os.path.join(table_dir, name)))
+    return sorted(result)
+
+def data_offset(file):
+    """Position of the first value in a .npy file"""
+    with open(file, "rb") as fp:
+        version = np.lib.format.read_magic(fp)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        read_header(fp)
+        return fp.tell()
+
+def read_value(partition, meta, column, i):
+    """The i-th value of a column, reads only its bytes"""
+    dtype = np.dtype(meta["dtypes"][column])
+    with open(os.path.join(partition, column_file(column)), "rb") as fp:
+        fp.seek(meta["offsets"][column] + i*dtype.itemsize)
+        return np.frombuffer(fp.read(dtype.itemsize), dtype)[0].item()
+
+def find_row(partition, meta, value):
+    """Index of the row whose key is value, None if it isn't there"""
+    key = meta["key"]
+    keys = np.fromfile(os.path.join(partition, column_file(key)), dtype=np.dtype(meta["dtypes"][key]), count=meta["rows"], offset=meta["offsets"][key])
+    i = np.searchsorted(keys, value)
+    return i if i < len(keys) and keys[i] == value else None
+
+def read_meta(partition):
+    with open(os.path.join(partition, META_FILE), "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+def read_partition(table, day, path = None):
+    """The whole table of one day"""
+    partition = os.path.join(path or ARCHIVE_DIR, table, f'{PARTITION_PREFIX}{day.isoformat()}')
+    meta = read_meta(partition)
+    return pd.DataFrame({column: np.load(os.path.join(partition, column_file(column))) for column in meta["columns"]})
+
+def history(table, value, columns = HISTORY_COLUMNS, start = None, end = None, path = None):
+    """Returns the columns of the row whose key is value for every archived day from start to end, one row per day.
+    Only the key column and the requested columns of the days in range are read, and of those only the found row."""
+    days = []
+    rows = []
+    for day, partition in partitions(table, start, end, path):
+        meta = read_meta(partition)
+        i = find_row(partition, meta, value)
+        if i is not None:
+            days.append(day)
+            rows.append([read_value(partition, meta, column, i) for column in columns])
+    return pd.DataFrame(rows, index=pd.Index(days, name="Date"), columns=list(columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank history of a ticker or an industry")
+    parser.add_argument("value", help="ticker, industry or sector")
+    parser.add_argument("--table", default="stocks", help="stocks, industries or sectors, with the suffix of another reference e.g. stocks_QQQ")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat)
+    args = parser.parse_args()
+    value = args.value.upper() if args.table.startswith("stocks") else args.value
+    print(history(args.table, value, start=args.start, end=args.end).to_string())
+
+if __name__ == "__main__":
+    main()
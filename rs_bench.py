@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""Benchmarks for loading and ranking with a synthetic universe, without network access.
+
+Prices are served by a local HTTP stand-in for the TDA pricehistory endpoint and the yahoo chart endpoint,
+with configurable latency and error rate. All files are written to a temporary folder.
+
+    python rs_bench.py --tickers 500 --days 400 --latency-ms 20 --error-rate 0.01
+    python rs_bench.py --size large --save bench.json
+    python rs_bench.py --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+import requests
+
+SIZES = {"small": 500, "medium": 8000, "large": 20000}
+REFERENCE_TICKER = "SPY"
+SECTORS = 11
+INDUSTRIES = 140
+
+def synthetic_tickers(count):
+    tickers = [REFERENCE_TICKER]
+    i = 0
+    while len(tickers) <= count:
+        # A..ZZZZ
+        name = ""
+        n = i
+        while True:
+            name = chr(ord("A") + n % 26) + name
+            n = n // 26 - 1
+            if n < 0:
+                break
+        if name != REFERENCE_TICKER:
+            tickers.append(name)
+        i = i + 1
+    return tickers
+
+def synthetic_securities(count):
+    securities = []
+    for ticker in synthetic_tickers(count):
+        if ticker == REFERENCE_TICKER:
+            securities.append({"ticker": ticker, "sector": "--- Reference ---", "industry": "--- Reference ---", "universe": "--- Reference ---"})
+            continue
+        industry = zlib.crc32(ticker.encode()) % INDUSTRIES
+        securities.append({"ticker": ticker, "sector": f'Sector {industry % SECTORS}', "industry": f'Industry {industry}', "universe": "NASDAQ"})
+    return securities
+
+def synthetic_dates(days):
+    return pd.bdate_range(end=date.today(), periods=days)
+
+def synthetic_candles(ticker, days):
+    """Deterministic random walk for ticker, about 5% of the tickers are listed for less than `days`"""
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    length = days if rng.random() > 0.05 else int(rng.integers(1, days))
+    closes = 20 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, length)))
+    spread = closes * rng.uniform(0, 0.02, length)
+    volumes = rng.integers(10**4, 10**7, length)
+    timestamps = synthetic_dates(days)[-length:].values.astype("datetime64[s]").astype(np.int64)
+    return closes, spread, volumes, timestamps
+
+def candles_list(ticker, days, timestamp_factor = 1):
+    closes, spread, volumes, timestamps = synthetic_candles(ticker, days)
+    return [
+        {"open": c, "close": c, "low": c - s, "high": c + s, "volume": v, "datetime": t * timestamp_factor}
+        for c, s, v, t in zip(closes.tolist(), spread.tolist(), volumes.tolist(), timestamps.tolist())
+    ]
+
+def generate_universe(count, days):
+    """Returns a price history in the price_history.json shape"""
+    tickers_dict = {}
+    for security in synthetic_securities(count):
+        ticker_data = {"candles": candles_list(security["ticker"], days)}
+        for field in ("sector", "industry", "universe"):
+            ticker_data[field] = security[field]
+        tickers_dict[security["ticker"]] = ticker_data
+    return tickers_dict
+
+
+def tda_response(ticker, days):
+    return {"candles": candles_list(ticker, days, 1000), "symbol": ticker, "empty": False}
+
+def yahoo_response(ticker, days):
+    closes, spread, volumes, timestamps = synthetic_candles(ticker, days)
+    quote = {"open": closes.tolist(), "close": closes.tolist(), "low": (closes - spread).tolist(), "high": (closes + spread).tolist(), "volume": volumes.tolist()}
+    return {"chart": {"result": [{"meta": {"symbol": ticker}, "timestamp": timestamps.tolist(), "indicators": {"quote": [quote]}}], "error": None}}
+
+def create_handler(days, latency_s, error_rate, stats):
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    class FakeProviderHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, count = True):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            if count:
+                with lock:
+                    stats[status] = stats.get(status, 0) + 1
+
+        def do_GET(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts == ["stats"]:
+                with lock:
+                    counts = {str(status): count for status, count in stats.items()}
+                return self.send_json(200, counts, count=False)
+            if latency_s:
+                time.sleep(latency_s * random.uniform(0.5, 1.5))
+            with lock:
+                failing = rng.random() < error_rate
+            if failing:
+                status = 429 if rng.random() < 0.5 else 500
+                self.send_json(status, {"error": "synthetic failure"})
+            elif len(parts) == 4 and parts[:2] == ["v1", "marketdata"] and parts[3] == "pricehistory":
+                self.send_json(200, tda_response(parts[2], days))
+            elif len(parts) == 4 and parts[:3] == ["v8", "finance", "chart"]:
+                self.send_json(200, yahoo_response(parts[3], days))
+            else:
+                self.send_json(404, {"error": "not found"})
+
+    return FakeProviderHandler
+
+def serve_fake_provider(days, latency_s, error_rate, port_queue, port = 0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(days, latency_s, error_rate, {}))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_fake_provider(days, latency_s = 0, error_rate = 0):
+    """Starts the local price provider on a free port in its own process, so it doesn't compete with the measured code.
+    Returns the process and the base url. GET /stats returns the counts by HTTP status."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_fake_provider, args=(days, latency_s, error_rate, port_queue), daemon=True)
+    process.start()
+    return process, f'http://127.0.0.1:{port_queue.get(timeout=30)}'
+
+
+class FakeYahooTicker:
+    """Stand-in for yf.Ticker that loads the chart from the local provider. Like yfinance, errors give an empty frame."""
+    base_url = None
+    session = requests.Session()
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def history(self, start = None, end = None, auto_adjust = True, **kwargs):
+        response = self.session.get(f'{self.base_url}/v8/finance/chart/{self.ticker}')
+        if response.status_code != 200:
+            return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume"])
+        result = response.json()["chart"]["result"][0]
+        quote = result["indicators"]["quote"][0]
+        index = pd.to_datetime(result["timestamp"], unit="s")
+        df = pd.DataFrame({"Open": quote["open"], "High": quote["high"], "Low": quote["low"], "Close": quote["close"], "Volume": quote["volume"]}, index=index)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df.index < pd.Timestamp(end)]
+        return df
+
+def fake_yahoo_download(tickers, start = None, end = None, **kwargs):
+    """Stand-in for yf.download with group_by="ticker" """
+    tickers = [tickers] if isinstance(tickers, str) else tickers
+    frames = {ticker: FakeYahooTicker(ticker).history(start, end) for ticker in tickers}
+    return pd.concat(frames, axis=1)
+
+
+def measure(name, count, run, memory = True):
+    """Runs `run` and returns wall time, throughput and (traced in a second run) peak memory"""
+    start = time.perf_counter()
+    run()
+    wall_s = time.perf_counter() - start
+    result = {"name": name, "tickers": count, "wall_s": round(wall_s, 3), "tickers_per_s": round(count / wall_s, 1)}
+    if memory:
+        tracemalloc.start()
+        run()
+        result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    return result
+
+def prepare_modules(workdir, base_url, store):
+    """Points rs_data, rs_store, rs_ticker_info and rs_ranking at the work folder and the local provider"""
+    import yfinance as yf
+    import rs_data
+    import rs_ranking
+    import rs_store
+    import rs_ticker_info
+
+    FakeYahooTicker.base_url = base_url
+    yf.Ticker = FakeYahooTicker
+    yf.download = fake_yahoo_download
+
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(os.path.join(workdir, "output"))
+    os.makedirs(data_dir)
+    rs_data.TD_API = base_url + "/v1/marketdata/%s/pricehistory"
+    rs_data.PRICE_DATA_FILE = os.path.join(data_dir, "price_history.json")
+    rs_data.FETCH_DIR = os.path.join(data_dir, "fetch")
+    rs_data.FETCH_DATA_FILE = os.path.join(rs_data.FETCH_DIR, "tickers.jsonl")
+    rs_data.FETCH_MANIFEST_FILE = os.path.join(rs_data.FETCH_DIR, "manifest.json")
+    rs_data.QUARANTINE_FILE = os.path.join(data_dir, "quarantine.json")
+    rs_data.PRICE_STORE = store
+    rs_data.INCREMENTAL_REFRESH = False
+    rs_store.PRICE_STORE_DIR = os.path.join(data_dir, "price_store")
+    rs_ticker_info.TICKER_INFO_DB = os.path.join(data_dir, "ticker_info.db")
+    rs_ticker_info.TICKER_INFO_FILE = os.path.join(data_dir, "ticker_info.json")
+    rs_ranking.DIR = workdir
+    rs_ranking.PRICE_DATA = rs_data.PRICE_DATA_FILE
+    rs_ranking.PRICE_STORE = store
+    rs_ranking.BREAKPOINTS_FILE = os.path.join(data_dir, "rs_breakpoints%s.npz")
+    rs_ranking.ARCHIVE_RANKINGS = False
+    rs_ranking.REFERENCE_TICKER = REFERENCE_TICKER
+    rs_ranking.REFERENCE_TICKERS = [REFERENCE_TICKER]
+    if rs_ranking.MIN_PERCENTILE is None:
+        rs_ranking.MIN_PERCENTILE = 70
+    return rs_data, rs_ranking
+
+def run_benchmarks(args):
+    count = SIZES.get(args.size, args.tickers)
+    workdir = tempfile.mkdtemp(prefix="rs_bench_")
+    provider, base_url = start_fake_provider(args.days, args.latency_ms / 1000, args.error_rate)
+    results = []
+    try:
+        rs_data, rs_ranking = prepare_modules(workdir, base_url, args.store)
+        securities = synthetic_securities(count)
+        # all tickers have info, so the TDA loader doesn't ask yahoo for it
+        info_dict = {sec["ticker"]: {"info": {"industry": sec["industry"], "sector": sec["sector"]}} for sec in securities}
+        rs_data.write_to_file(info_dict, os.path.join(workdir, "data", "ticker_info.json"))
+        rs_data.FETCH_WORKERS = args.workers
+        rs_data.YAHOO_BATCH_SIZE = args.yahoo_batch_size
+        rs_data.TDA_RATE_LIMIT = args.rate_limit
+
+        if "tda" in args.only:
+            results.append(measure("load_prices_from_tda", len(securities), lambda: rs_data.load_prices_from_tda(securities, "bench", {}), args.memory))
+        if "yahoo" in args.only:
+            results.append(measure("load_prices_from_yahoo", len(securities), lambda: rs_data.load_prices_from_yahoo(securities, {}), args.memory))
+        if "rankings" in args.only:
+            rs_data.write_price_history_file(generate_universe(count, args.days))
+            results.append(measure("rs_ranking.rankings", len(securities), rs_ranking.rankings, args.memory))
+        stats = requests.get(base_url + "/stats").json()
+    finally:
+        provider.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"tickers": count, "days": args.days, "store": args.store, "workers": args.workers, "latency_ms": args.latency_ms, "error_rate": args.error_rate, "http_status": stats, "results": results}
+
+def compare(report, baseline, tolerance):
+    """Returns the benchmarks that got slower or use more memory than the baseline allows"""
+    regressions = []
+    previous = {result["name"]: result for result in baseline["results"]}
+    for result in report["results"]:
+        if result["name"] not in previous:
+            continue
+        for key in ("wall_s", "peak_mb"):
+            if key in result and key in previous[result["name"]] and result[key] > previous[result["name"]][key] * (1 + tolerance):
+                regressions.append(f'{result["name"]} {key}: {result[key]} > {previous[result["name"]][key]} (+{int(tolerance*100)}%)')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks loading and ranking with a synthetic universe and a local price provider.")
+    parser.add_argument("--size", choices=SIZES.keys(), help="preset universe size (overrides --tickers)")
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--yahoo-batch-size", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0, help="TDA requests per second (0 = unlimited)")
+    parser.add_argument("--store", choices=("BINARY", "JSON"), default="BINARY")
+    parser.add_argument("--only", nargs="+", choices=("tda", "yahoo", "rankings"), default=["tda", "yahoo", "rankings"])
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced run for peak memory")
+    parser.add_argument("--save", help="write the report to this json file")
+    parser.add_argument("--baseline", help="fail if slower than this saved report")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--serve", type=int, metavar="PORT", help="only run the local price provider on PORT")
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        print(f'Serving synthetic prices on http://127.0.0.1:{args.serve}')
+        serve_fake_provider(args.days, args.latency_ms / 1000, args.error_rate, multiprocessing.Queue(), args.serve)
+        return
+
+    # progress output of the loaders is not part of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        report = run_benchmarks(args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    for result in report["results"]:
+        memory = f', peak {result["peak_mb"]} MB' if "peak_mb" in result else ""
+        print(f'{result["name"]}: {result["wall_s"]}s for {result["tickers"]} tickers ({result["tickers_per_s"]}/s){memory}')
+    print(f'HTTP status counts: {report["http_status"]}')
+    if args.save:
+        with open(args.save, "w", encoding="utf8") as fp:
+            json.dump(report, fp, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fp:
+            regressions = compare(report, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import json
+import os
+import yaml
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+try:
+    with open(os.path.join(DIR, 'config_private.yaml'), 'r') as stream:
+        private_config = yaml.safe_load(stream)
+except FileNotFoundError:
+    private_config = None
+except yaml.YAMLError as exc:
+        print(exc)
+
+try:
+    with open('config.yaml', 'r') as stream:
+        config = yaml.safe_load(stream)
+except FileNotFoundError:
+    config = None
+except yaml.YAMLError as exc:
+        print(exc)
+
+def cfg(key):
+    try:
+        return private_config[key]
+    except:
+        try:
+            return config[key]
+        except:
+            return None
+
+def read_json(json_file):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        return json.load(fp)
@@ -5,18 +5,26 @@ import time
 import bs4 as bs
 import datetime as dt
 import os
-import pandas_datareader.data as web
 import pickle
 import requests
-import yaml
 import yfinance as yf
 import pandas as pd
 import dateutil.relativedelta
 import numpy as np
+import itertools
 import re
+import sys
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from rs_config import cfg, read_json
+import rs_http
+import rs_metrics
+import rs_quality
+import rs_store
+import rs_ticker_info
 from ftplib import FTP
 from io import StringIO
-from time import sleep
 
 from datetime import date
 from datetime import datetime
@@ -28,46 +36,46 @@ if not os.path.exists(os.path.join(DIR, 'data')):
 if not os.path.exists(os.path.join(DIR, 'tmp')):
     os.makedirs(os.path.join(DIR, 'tmp'))
 
-try:
-    with open(os.path.join(DIR, 'config_private.yaml'), 'r') as stream:
-        private_config = yaml.safe_load(stream)
-except FileNotFoundError:
-    private_config = None
-except yaml.YAMLError as exc:
-        print(exc)
-
-try:
-    with open('config.yaml', 'r') as stream:
-        config = yaml.safe_load(stream)
-except FileNotFoundError:
-    config = None
-except yaml.YAMLError as exc:
-        print(exc)
-
-def cfg(key):
-    try:
-        return private_config[key]
-    except:
-        try:
-            return config[key]
-        except:
-            return None
-
-def read_json(json_file):
-    with open(json_file, "r", encoding="utf-8") as fp:
-        return json.load(fp)
-
 API_KEY = cfg("API_KEY")
 TD_API = "https://api.tdameritrade.com/v1/marketdata/%s/pricehistory"
 PRICE_DATA_FILE = os.path.join(DIR, "data", "price_history.json")
-REFERENCE_TICKER = cfg("REFERENCE_TICKER")
+UNIVERSE_FILE = os.path.join(DIR, "data", "universe.json")
+FETCH_DIR = os.path.join(DIR, "data", "fetch")
+FETCH_DATA_FILE = os.path.join(FETCH_DIR, "tickers.jsonl")
+FETCH_MANIFEST_FILE = os.path.join(FETCH_DIR, "manifest.json")
+QUARANTINE_FILE = os.path.join(DIR, "data", "quarantine.json")
+REPAIRED_FILE = os.path.join(DIR, "data", "repaired.json")
+SHARD_DIR = os.path.join(DIR, "data", "shards")
+# (i, N) while loading the i-th of N shards
+SHARD = None
+UNIVERSE_MAX_AGE_HOURS = cfg("UNIVERSE_MAX_AGE_HOURS") or 24
+OFFLINE = cfg("OFFLINE")
+REFERENCE_TICKERS = cfg("REFERENCE_TICKERS") or [cfg("REFERENCE_TICKER")]
+REFERENCE_TICKER = REFERENCE_TICKERS[0]
 DATA_SOURCE = cfg("DATA_SOURCE")
+FALLBACK_DATA_SOURCE = cfg("FALLBACK_DATA_SOURCE")
+HEDGE_AFTER_SECONDS = cfg("HEDGE_AFTER_SECONDS") or 10
+REPAIR_PRICE_DATA = cfg("REPAIR_PRICE_DATA")
 ALL_STOCKS = cfg("USE_ALL_LISTED_STOCKS")
-TICKER_INFO_FILE = os.path.join(DIR, "data_persist", "ticker_info.json")
-TICKER_INFO_DICT = read_json(TICKER_INFO_FILE)
-REF_TICKER = {"ticker": REFERENCE_TICKER, "sector": "--- Reference ---", "industry": "--- Reference ---", "universe": "--- Reference ---"}
+FETCH_WORKERS = cfg("FETCH_WORKERS") or 1
+YAHOO_BATCH_SIZE = cfg("YAHOO_BATCH_SIZE") or 0
+INCREMENTAL_REFRESH = cfg("INCREMENTAL_REFRESH")
+PRICE_STORE = cfg("PRICE_STORE") or "JSON"
+# price history needed by rs_ranking: one year for the strength plus 6 months of look back
+HISTORY_DAYS = 1*365+183 # 183 = 6 months
+TICKER_INFO_TTL_DAYS = cfg("TICKER_INFO_TTL_DAYS") or 90
+TICKER_INFO_FAILED_TTL_DAYS = cfg("TICKER_INFO_FAILED_TTL_DAYS") or 7
+# TDA allows 120 requests per minute
+TDA_RATE_LIMIT = 2 if cfg("TDA_RATE_LIMIT") is None else cfg("TDA_RATE_LIMIT")
+HTTP_RETRIES = 3 if cfg("HTTP_RETRIES") is None else cfg("HTTP_RETRIES")
+QUARANTINE_AFTER_RUNS = cfg("QUARANTINE_AFTER_RUNS") or 3
+QUARANTINE_DAYS = cfg("QUARANTINE_DAYS") or 7
+# relative difference of a reloaded close that means the source adjusted the history (split or dividend)
+ADJUSTMENT_TOLERANCE = 1e-4
 
 UNKNOWN = "unknown"
+# candle schema of get_yf_data, datetime in seconds
+CANDLE_KEYS = ("open", "close", "low", "high", "volume", "datetime")
 
 def get_securities(url, ticker_pos = 1, table_pos = 1, sector_offset = 1, industry_offset = 1, universe = "N/A"):
     resp = requests.get(url)
@@ -85,8 +93,11 @@ def get_securities(url, ticker_pos = 1, table_pos = 1, sector_offset = 1, indust
         pickle.dump(secs, f)
     return secs
 
+def reference_security(ticker):
+    return {"ticker": ticker, "sector": "--- Reference ---", "industry": "--- Reference ---", "universe": "--- Reference ---"}
+
 def get_resolved_securities():
-    tickers = {REFERENCE_TICKER: REF_TICKER}
+    tickers = {ticker: reference_security(ticker) for ticker in REFERENCE_TICKERS}
     if ALL_STOCKS:
         return get_tickers_from_nasdaq(tickers)
         # return {"1": {"ticker": "DTST", "sector": "MICsec", "industry": "MICind", "universe": "we"}, "2": {"ticker": "MIGI", "sector": "MIGIsec", "industry": "MIGIind", "universe": "we"}}
@@ -147,33 +158,298 @@ def get_tickers_from_nasdaq(tickers):
 
     return tickers
 
-SECURITIES = get_resolved_securities().values()
+def universe_key():
+    """Config values that decide which securities are resolved"""
+    return {"ALL_STOCKS": ALL_STOCKS, "REFERENCE_TICKERS": REFERENCE_TICKERS, "NQ100": cfg("NQ100"), "SP500": cfg("SP500"), "SP400": cfg("SP400"), "SP600": cfg("SP600")}
+
+def read_universe_snapshot():
+    try:
+        return read_json(UNIVERSE_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def load_securities(max_age_hours = None, offline = None):
+    """Returns the resolved securities. They are resolved at most every UNIVERSE_MAX_AGE_HOURS, in between (and offline) the snapshot in data/universe.json is used."""
+    max_age_hours = UNIVERSE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    offline = OFFLINE if offline is None else offline
+    snapshot = read_universe_snapshot()
+    if snapshot and snapshot["key"] != universe_key():
+        snapshot = None
+    if snapshot and (offline or time.time() - snapshot["created"] < max_age_hours * 60 * 60):
+        return snapshot["securities"].values()
+    if offline:
+        raise RuntimeError(f'Offline and no universe snapshot in {UNIVERSE_FILE} matches the config.')
+    try:
+        securities = get_resolved_securities()
+    except Exception as e:
+        if not snapshot:
+            raise
+        print(f'Could not resolve securities ({e}), using the snapshot from {datetime.fromtimestamp(snapshot["created"])}.')
+        return snapshot["securities"].values()
+    write_to_file({"created": time.time(), "key": universe_key(), "securities": securities}, UNIVERSE_FILE)
+    return securities.values()
+
+def __getattr__(name):
+    # SECURITIES used to be resolved on import, now it is only resolved when used
+    if name == "SECURITIES":
+        return load_securities()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def write_to_file(dict, file):
     with open(file, "w", encoding='utf8') as fp:
         json.dump(dict, fp, ensure_ascii=False)
 
-def write_price_history_file(tickers_dict):
-    write_to_file(tickers_dict, PRICE_DATA_FILE)
+def write_price_history_file(tickers):
+    """Writes the price history from a dict or (ticker, ticker_data) pairs. Pairs are written as they come without keeping them all in memory."""
+    items = tickers.items() if isinstance(tickers, dict) else tickers
+    if SHARD:
+        rs_store.write_price_store(items, shard_dir(SHARD))
+        return
+    if PRICE_STORE == "BINARY":
+        rs_store.write_price_store(items)
+        return
+    with open(PRICE_DATA_FILE, "w", encoding='utf8') as fp:
+        fp.write("{")
+        for idx, (ticker, ticker_data) in enumerate(items):
+            fp.write(", " if idx > 0 else "")
+            fp.write(json.dumps(ticker, ensure_ascii=False) + ": " + json.dumps(ticker_data, ensure_ascii=False))
+        fp.write("}")
+
+def parse_shard(spec):
+    """"i/N" -> (i, N), shards are counted from 1"""
+    try:
+        i, count = (int(value) for value in spec.split("/"))
+    except ValueError:
+        raise ValueError(f'Invalid shard {spec}, expected i/N e.g. 1/4')
+    if not 1 <= i <= count:
+        raise ValueError(f'Invalid shard {spec}, i has to be between 1 and N')
+    return i, count
+
+def shard_dir(shard):
+    return os.path.join(SHARD_DIR, f'shard-{shard[0]}-of-{shard[1]}')
+
+def shard_securities(securities, shard):
+    """The securities of the i-th of N shards. The crc32 of the ticker decides, so every runner splits the same way."""
+    i, count = shard
+    return [sec for sec in securities if zlib.crc32(sec["ticker"].encode("utf-8")) % count == i - 1]
+
+def use_shard(shard):
+    """Writes the price history and the checkpoint of this run to the folder of the shard instead"""
+    global SHARD, FETCH_DIR, FETCH_DATA_FILE, FETCH_MANIFEST_FILE
+    SHARD = shard
+    FETCH_DIR = os.path.join(shard_dir(shard), "fetch")
+    FETCH_DATA_FILE = os.path.join(FETCH_DIR, "tickers.jsonl")
+    FETCH_MANIFEST_FILE = os.path.join(FETCH_DIR, "manifest.json")
+
+def check_shard_days(shards):
+    """Refuses to merge shards that were loaded on different trading days, as their histories end on different days"""
+    days = {}
+    for shard in shards:
+        try:
+            days[shard] = read_json(os.path.join(shard_dir(shard), "fetch", "manifest.json"))["trading_day"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            raise RuntimeError(f'Shard {shard[0]} of {shard[1]} has no fetch manifest, so its trading day is unknown')
+    if len(set(days.values())) > 1:
+        found = ", ".join(f'{i}: {day}' for (i, _), day in sorted(days.items()))
+        raise RuntimeError(f'The shards were loaded on different trading days ({found}), load the outdated ones again')
+    day = next(iter(days.values()))
+    if day < trading_day().isoformat():
+        print(f'Warning: the shards were loaded on {day}, the last trading day is {trading_day().isoformat()}.')
+
+def merge_shards():
+    """Combines the price stores of all shards in data/shards into the price history that rs_ranking reads"""
+    shards = set()
+    for name in os.listdir(SHARD_DIR) if os.path.exists(SHARD_DIR) else []:
+        match = re.match(r'^shard-(\d+)-of-(\d+)$', name)
+        if match and rs_store.price_store_exists(os.path.join(SHARD_DIR, name)):
+            shards.add((int(match.group(1)), int(match.group(2))))
+    counts = set(count for _, count in shards)
+    if len(counts) != 1:
+        raise RuntimeError(f'Expected the shards of one split in {SHARD_DIR}, found {sorted(shards)}')
+    count = counts.pop()
+    missing = [i for i in range(1, count + 1) if (i, count) not in shards]
+    if missing:
+        raise RuntimeError(f'Shards {",".join(map(str, missing))} of {count} are missing in {SHARD_DIR}')
+    paths = [shard_dir((i, count)) for i in range(1, count + 1)]
+    check_shard_days([(i, count) for i in range(1, count + 1)])
+    snapshot = read_universe_snapshot()
+    # same order as an unsharded run where the universe is known
+    order = list(snapshot["securities"]) if snapshot else None
+    if PRICE_STORE == "BINARY":
+        merged = rs_store.merge_price_stores(paths, order=order)
+    else:
+        tickers_dict = {}
+        for path in paths:
+            tickers_dict.update(rs_store.store_to_dict(rs_store.read_price_store(path)))
+        if order:
+            position = {ticker: i for i, ticker in enumerate(order)}
+            tickers_dict = dict(sorted(tickers_dict.items(), key=lambda item: position.get(item[0], len(position))))
+        write_price_history_file(tickers_dict)
+        merged = len(tickers_dict)
+    print(f'Merged {merged} tickers of {count} shards.')
+
+def trading_day(day = None):
+    """Most recent weekday, holidays are not considered"""
+    day = day or date.today()
+    while day.weekday() >= 5:
+        day = day - dt.timedelta(days=1)
+    return day
+
+def checkpoint_offsets(file):
+    """Returns the file offsets of all completely written tickers and the length of the valid part of the file"""
+    offsets = {}
+    end = 0
+    if not os.path.exists(file):
+        return offsets, end
+    with open(file, "rb") as fp:
+        for line in fp:
+            # a line without line break was cut off
+            if not line.endswith(b"\n"):
+                break
+            ticker = line[:line.index(b"\t")].decode("utf-8")
+            offsets[ticker] = end
+            end = end + len(line)
+    return offsets, end
+
+def open_checkpoint(source, resume = False):
+    """Every loaded ticker is appended to data/fetch/tickers.jsonl right away.
+    When resuming, the tickers already loaded for the same trading day and source are kept, otherwise a new checkpoint is started."""
+    if not os.path.exists(FETCH_DIR):
+        os.makedirs(FETCH_DIR)
+    manifest = {"trading_day": trading_day().isoformat(), "source": source}
+    try:
+        previous_manifest = read_json(FETCH_MANIFEST_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        previous_manifest = None
+    completed = set()
+    if resume and previous_manifest == manifest:
+        offsets, end = checkpoint_offsets(FETCH_DATA_FILE)
+        completed = set(offsets)
+        with open(FETCH_DATA_FILE, "ab") as fp:
+            fp.truncate(end)
+        print(f'Resuming with {len(completed)} tickers loaded on {manifest["trading_day"]}.')
+    else:
+        if os.path.exists(FETCH_DATA_FILE):
+            os.remove(FETCH_DATA_FILE)
+        write_to_file(manifest, FETCH_MANIFEST_FILE)
+    return {
+        "file": open(FETCH_DATA_FILE, "a", encoding="utf8"),
+        "completed": completed,
+        "lock": threading.Lock(),
+        "count": 0
+    }
 
-def write_ticker_info_file(info_dict):
-    write_to_file(info_dict, TICKER_INFO_FILE)
+def append_checkpoint(checkpoint, ticker, ticker_data):
+    line = ticker + "\t" + json.dumps(ticker_data, ensure_ascii=False) + "\n"
+    with checkpoint["lock"]:
+        fp = checkpoint["file"]
+        fp.write(line)
+        fp.flush()
+        checkpoint["count"] = checkpoint["count"] + 1
+        if checkpoint["count"] % 25 == 0:
+            os.fsync(fp.fileno())
+
+def keep_stored(checkpoint, tickers, previous = None):
+    """Appends the stored entries of tickers that are not loaded in this run (e.g. quarantined ones) to the checkpoint,
+    so the price history written from it still has their candles"""
+    tickers = [ticker for ticker in tickers if ticker not in checkpoint["completed"]]
+    if not tickers:
+        return
+    previous = previous or read_previous_prices()
+    for ticker in tickers:
+        if ticker in previous:
+            append_checkpoint(checkpoint, ticker, previous[ticker])
+
+def close_checkpoint(checkpoint):
+    fp = checkpoint["file"]
+    fp.flush()
+    os.fsync(fp.fileno())
+    fp.close()
+
+def read_checkpoint(securities):
+    """Yields (ticker, ticker_data) of the checkpoint one at a time, in the order of securities"""
+    offsets, end = checkpoint_offsets(FETCH_DATA_FILE)
+    with open(FETCH_DATA_FILE, "rb") as fp:
+        for sec in securities:
+            if sec["ticker"] not in offsets:
+                continue
+            fp.seek(offsets[sec["ticker"]])
+            line = fp.readline()
+            yield sec["ticker"], json.loads(line[line.index(b"\t")+1:])
 
 def enrich_ticker_data(ticker_response, security):
     ticker_response["sector"] = security["sector"]
     ticker_response["industry"] = security["industry"]
     ticker_response["universe"] = security["universe"]
 
-def tda_params(apikey, period_type="year", period=2, frequency_type="daily", frequency=1):
-    """Returns tuple of api get params. Uses clenow default values."""
+def reduce_ticker(ticker_data, window):
+    """Only what the ranking needs of a loaded ticker: the stock info, the last `window` closes and the timestamp of the last one"""
+    reduced = {field: ticker_data.get(field) for field in rs_store.META_FIELDS}
+    candles = (ticker_data.get("candles") or [])[-window:]
+    reduced["closes"] = np.fromiter((candle["close"] for candle in candles), dtype=np.float64, count=len(candles))
+    reduced["last_timestamp"] = rs_store.timestamp_seconds(candles[-1]["datetime"]) if candles else None
+    return reduced
+
+def tda_params(apikey, period_type="year", period=2, frequency_type="daily", frequency=1, start_date=None):
+    """Returns tuple of api get params. Uses clenow default values.
+    If start_date is given only the candles from that day until now are requested instead of the period."""
+    if start_date:
+        start_ms = int(datetime.combine(start_date, datetime.min.time()).timestamp() * 1000)
+        date_range = (("startDate", start_ms), ("endDate", int(time.time() * 1000)))
+    else:
+        date_range = (("period", period),)
     return (
            ("apikey", apikey),
            ("periodType", period_type),
-           ("period", period),
+           *date_range,
            ("frequencyType", frequency_type),
            ("frequency", frequency)
     )
 
+def candle_date(candle):
+    """Day of a candle. TDA timestamps are in milliseconds, yahoo timestamps in seconds."""
+    return datetime.utcfromtimestamp(rs_store.timestamp_seconds(candle["datetime"])).date()
+
+def read_previous_prices():
+    """Returns the stored price history or an empty dict if there is none yet"""
+    try:
+        if PRICE_STORE == "BINARY":
+            return rs_store.store_to_dict(rs_store.read_price_store()) if rs_store.price_store_exists() else {}
+        return read_json(PRICE_DATA_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def refresh_start_date(previous, ticker, default_start):
+    """First day that has to be (re)loaded for ticker. The last stored day is loaded again as it may have been incomplete,
+    and the day before, which was complete when stored, to see whether the source adjusted the history since (see adjustment_changed)."""
+    candles = previous.get(ticker, {}).get("candles")
+    if not candles:
+        return default_start
+    return max(candle_date(candles[-2 if len(candles) > 1 else -1]), default_start)
+
+def close_on(candles, day):
+    for candle in reversed(candles):
+        if candle_date(candle) == day:
+            return candle["close"]
+    return None
+
+def adjustment_changed(old_candles, new_candles, since):
+    """True if the close of the day since differs between the stored and the reloaded candles.
+    The source adjusted its history for a split or dividend then, and the new candles can't be appended to the stored ones."""
+    old_close = close_on(old_candles, since)
+    new_close = close_on(new_candles, since)
+    if not old_close or new_close is None:
+        return False
+    return abs(new_close - old_close) > ADJUSTMENT_TOLERANCE * abs(old_close)
+
+def merge_candles(old_candles, new_candles, since, keep_from):
+    """Replaces the old candles from since on with the new ones and drops everything before keep_from.
+    New candles before since are dropped too, as some sources return more days than requested."""
+    if not new_candles:
+        new_candles = [c for c in old_candles if candle_date(c) >= since]
+    kept = [c for c in old_candles if keep_from <= candle_date(c) < since]
+    return kept + [c for c in new_candles if candle_date(c) >= max(since, keep_from)]
+
 def print_data_progress(ticker, universe, idx, securities, error_text, elapsed_s, remaining_s):
     dt_ref = datetime.fromtimestamp(0)
     dt_e = datetime.fromtimestamp(elapsed_s)
@@ -186,133 +462,510 @@ def print_data_progress(ticker, universe, idx, securities, error_text, elapsed_s
         remaining_string = "?"
     print(f'{ticker} from {universe}{error_text} ({idx+1} / {len(securities)}). Elapsed: {elapsed.hours}h {elapsed.minutes}m {elapsed.seconds}s. Remaining: {remaining_string}.')
 
-def get_remaining_seconds(all_load_times, idx, len):
-    load_time_ma = pd.Series(all_load_times).rolling(np.minimum(idx+1, 25)).mean().tail(1).item()
-    remaining_seconds = (len - idx) * load_time_ma
-    return remaining_seconds
-
 def escape_ticker(ticker):
     return ticker.replace(".","-")
 
-def get_info_from_dict(dict, key):
-    value = dict[key] if key in dict else "n/a"
-    # fix unicode
-    # value = value.replace("\u2014", " ")
-    return value
-
-def load_ticker_info(ticker, info_dict):
-    escaped_ticker = escape_ticker(ticker)
-    info = yf.Ticker(escaped_ticker)
-    ticker_info = {
-        "info": {
-            "industry": get_info_from_dict(info.info, "industry"),
-            "sector": get_info_from_dict(info.info, "sector")
-        }
-    }
-    info_dict[ticker] = ticker_info
+def load_ticker_info(securities):
+    """Loads industry and sector of all tickers that are not cached or whose cache entry expired"""
+    tickers = [sec["ticker"] for sec in securities]
+    with rs_metrics.stage("metadata"):
+        rs_ticker_info.refresh(tickers, FETCH_WORKERS, TICKER_INFO_TTL_DAYS, TICKER_INFO_FAILED_TTL_DAYS)
 
-def load_prices_from_tda(securities, api_key, info = {}):
-    print("*** Loading Stocks from TD Ameritrade ***")
-    headers = {"Cache-Control" : "no-cache"}
-    params = tda_params(api_key)
-    tickers_dict = {}
+def read_quarantine():
+    try:
+        return read_json(QUARANTINE_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def is_quarantined(quarantine, ticker, now = None):
+    """Tickers that failed in QUARANTINE_AFTER_RUNS runs in a row are skipped for QUARANTINE_DAYS"""
+    entry = quarantine.get(ticker)
+    if not entry or entry["failures"] < QUARANTINE_AFTER_RUNS:
+        return False
+    return (now or time.time()) - entry["failed"] < QUARANTINE_DAYS*24*60*60
+
+def update_quarantine(quarantine, ticker, status):
+    """Counts a failed load of ticker (status is None for a successful one)"""
+    if status is None:
+        quarantine.pop(ticker, None)
+        return
+    entry = quarantine.get(ticker, {"failures": 0})
+    quarantine[ticker] = {"failures": entry["failures"] + 1, "failed": time.time(), "status": str(status)}
+
+def previous_prices(info):
+    """The stored price history an incremental load starts from"""
+    # a streamed run doesn't write the price history, so it always loads the whole window
+    return read_previous_prices() if INCREMENTAL_REFRESH and not info.get("reduce") else {}
+
+def save_prices(securities, source, info, load, skipped = (), previous = None):
+    """Runs load(securities, checkpoint) -> price data for all securities but the skipped ones.
+    A streamed run (info["reduce"]) returns the price data. Any other run loads into the checkpoint and writes the price history
+    from it, with the stored candles of the skipped tickers."""
+    loaded = [sec for sec in securities if sec["ticker"] not in skipped]
+    if info.get("reduce"):
+        return load(loaded, None)
+    checkpoint = open_checkpoint(source, info.get("resume"))
+    keep_stored(checkpoint, skipped, previous)
+    load(loaded, checkpoint)
+    close_checkpoint(checkpoint)
+    write_price_history_file(read_checkpoint(securities))
+
+def load_all(securities, load_ticker, workers = None, checkpoint = None):
+    """Calls load_ticker(security) -> (ticker_data, error_text) for all securities, with up to `workers` requests in flight.
+    Returns the ticker data keyed by ticker, in the order of securities. Tickers whose ticker_data is None are left out.
+    With a checkpoint the completed tickers are skipped and the results are appended to it instead."""
+    workers = workers or FETCH_WORKERS
+    securities = list(securities)
+    if checkpoint:
+        securities = [sec for sec in securities if sec["ticker"] not in checkpoint["completed"]]
+    results = {}
     start = time.time()
-    load_times = []
-    new_entries = 0
+    estimate_remaining = rs_metrics.create_eta_estimator(len(securities), workers)
 
-    for idx, sec in enumerate(securities):
-        ticker = sec["ticker"]
+    def timed_load(security):
         r_start = time.time()
-        response = requests.get(
-                TD_API % ticker,
-                params=params,
-                headers=headers
+        ticker_data, error_text = load_ticker(security)
+        return security, ticker_data, error_text, time.time() - r_start
+
+    def record(idx, result):
+        security, ticker_data, error_text, load_time = result
+        remaining_seconds = estimate_remaining(load_time)
+        if ticker_data is not None and checkpoint:
+            append_checkpoint(checkpoint, security["ticker"], ticker_data)
+        elif ticker_data is not None:
+            results[security["ticker"]] = ticker_data
+        print_data_progress(security["ticker"], security["universe"], idx, securities, error_text, time.time() - start, remaining_seconds)
+
+    if workers <= 1:
+        for idx, security in enumerate(securities):
+            record(idx, timed_load(security))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # only a window of requests is submitted at a time, so a loaded ticker is dropped as soon as it is recorded
+            remaining = iter(securities)
+            pending = set()
+            idx = 0
+            while True:
+                for security in itertools.islice(remaining, 2*workers - len(pending)):
+                    pending.add(executor.submit(timed_load, security))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(idx, future.result())
+                    idx = idx + 1
+                del done
+
+    return {sec["ticker"]: results[sec["ticker"]] for sec in securities if sec["ticker"] in results}
+
+def tda_fetcher(api_key):
+    """Returns fetch(security, since) -> (ticker_data, status) for TD Ameritrade. ticker_data is None if the request failed.
+    Without since the default period is loaded."""
+    headers = {"Cache-Control" : "no-cache"}
+    session = rs_http.create_session(FETCH_WORKERS)
+    limiter = rs_http.create_rate_limiter(TDA_RATE_LIMIT)
+
+    def fetch(security, since = None):
+        ticker_data, status = rs_http.get_json(
+                session,
+                TD_API % security["ticker"],
+                params=tda_params(api_key, start_date=since),
+                headers=headers,
+                limiter=limiter,
+                retries=HTTP_RETRIES,
+                source="TD_AMERITRADE"
         )
-        ticker_data = response.json()
-        if not ticker in TICKER_INFO_DICT:
-            new_entries = new_entries + 1
-            load_ticker_info(ticker, TICKER_INFO_DICT)
-            if new_entries % 25 == 0:
-                write_ticker_info_file(TICKER_INFO_DICT)
-        ticker_data["industry"] = TICKER_INFO_DICT[ticker]["info"]["industry"]
-        now = time.time()
-        current_load_time = now - r_start
-        load_times.append(current_load_time)
-        remaining_seconds = get_remaining_seconds(load_times, idx, len(securities))
-        enrich_ticker_data(ticker_data, sec)
-        tickers_dict[sec["ticker"]] = ticker_data
-        error_text = f' Error with code {response.status_code}' if response.status_code != 200 else ''
-        print_data_progress(sec["ticker"], sec["universe"], idx, securities, error_text, now - start, remaining_seconds)
-
-        # throttle if triggered from github
-        if info["forceTDA"]:
-            sleep(0.4)
-
-    write_price_history_file(tickers_dict)
+        # error answers come with status 200 too, but without candles
+        if ticker_data is None or "candles" not in ticker_data:
+            return None, status
+        return ticker_data, status
+    return fetch
+
+def yahoo_fetcher():
+    """Returns fetch(security, since) -> (ticker_data, status) for yahoo. ticker_data is None if yahoo has no candles."""
+    def fetch(security, since):
+        r_start = time.time()
+        ticker_data = get_yf_data(security, since, date.today())
+        # yfinance does not expose the http status, empty answers are counted instead
+        status = "ok" if ticker_data["candles"] else "empty"
+        rs_metrics.observe_request("YAHOO", time.time() - r_start, status)
+        return (ticker_data if ticker_data["candles"] else None), status
+    return fetch
 
+def load_prices_from_tda(securities, api_key, info = {}):
+    print("*** Loading Stocks from TD Ameritrade ***")
+    reduce = info.get("reduce")
+    previous = previous_prices(info)
+    keep_from = date.today() - dt.timedelta(days=HISTORY_DAYS)
+    fetch = tda_fetcher(api_key)
+    quarantine = read_quarantine()
+    quarantine_lock = threading.Lock()
+
+    def load_ticker(sec):
+        ticker = sec["ticker"]
+        since = refresh_start_date(previous, ticker, keep_from) if ticker in previous else None
+        ticker_data, status = fetch(sec, since)
+        if ticker_data is not None and since and adjustment_changed(previous[ticker]["candles"], ticker_data["candles"], since):
+            # the stored history has the old adjustment, the whole period is loaded again (or the stored candles kept if that fails)
+            ticker_data, status = fetch(sec)
+            since = since if ticker_data is None else None
+        failed = ticker_data is None
+        with quarantine_lock:
+            update_quarantine(quarantine, ticker, status if failed else None)
+        if failed and not since:
+            return None, f' Error with code {status}, not saved'
+        error_text = ''
+        if failed:
+            # the stored candles are kept, the missing days are loaded with the next run
+            ticker_data = {"candles": []}
+            error_text = f' Error with code {status}, kept the stored candles'
+        if since:
+            ticker_data["candles"] = merge_candles(previous[ticker]["candles"], ticker_data["candles"], since, keep_from)
+        enrich_ticker_data(ticker_data, sec)
+        return (reduce(ticker_data) if reduce else ticker_data), error_text
+
+    securities = list(securities)
+    skipped = [sec["ticker"] for sec in securities if sec["ticker"] not in REFERENCE_TICKERS and is_quarantined(quarantine, sec["ticker"])]
+    if skipped:
+        print(f'Skipping {len(skipped)} quarantined tickers: {",".join(skipped)}')
+    load_ticker_info([sec for sec in securities if sec["ticker"] not in skipped])
+    price_data = save_prices(securities, "TD_AMERITRADE", info, lambda loaded, checkpoint: load_all(loaded, load_ticker, checkpoint=checkpoint), skipped, previous)
+    write_to_file(quarantine, QUARANTINE_FILE)
+    return price_data
+
+
+def candles_from_frame(df):
+    """Converts a yahoo OHLCV frame to the candle list stored in price_history.json"""
+    df = df.dropna(subset=["Close"])
+    timestamps = df.index.values.astype("datetime64[s]").astype(np.int64)
+    columns = (
+        df["Open"].tolist(),
+        df["Close"].tolist(),
+        df["Low"].tolist(),
+        df["High"].tolist(),
+        df["Volume"].tolist(),
+        timestamps.tolist()
+    )
+    return [dict(zip(CANDLE_KEYS, values)) for values in zip(*columns)]
+
+def normalize_candles(candles):
+    """Candles of any source in the schema of get_yf_data"""
+    return [{**{key: candle.get(key) for key in CANDLE_KEYS}, "datetime": rs_store.timestamp_seconds(candle["datetime"])} for candle in candles]
+
+def hedged_fetch(security, since, fetchers, hedge_after_s, executor):
+    """Asks the first of fetchers [(source, fetch)] and, if it fails or hasn't answered within hedge_after_s, the next one as well.
+    Returns (ticker_data, source, statuses) of the first valid answer. ticker_data and source are None if all sources failed.
+    Requests that lose the race keep running in the executor, their answers are dropped."""
+    pending = {}
+    statuses = {}
+    for idx, (source, fetch) in enumerate(fetchers):
+        if idx > 0:
+            rs_metrics.count("hedged_requests_total", source=source)
+        pending[executor.submit(fetch, security, since)] = source
+        last = idx == len(fetchers) - 1
+        while pending:
+            done, _ = wait(pending, timeout=None if last else hedge_after_s, return_when=FIRST_COMPLETED)
+            for future in done:
+                done_source = pending.pop(future)
+                try:
+                    ticker_data, statuses[done_source] = future.result()
+                except Exception as e:
+                    ticker_data, statuses[done_source] = None, type(e).__name__
+                if ticker_data is not None:
+                    return ticker_data, done_source, statuses
+            # too slow or failed, ask the next source
+            if not last:
+                break
+    return None, None, statuses
+
+def fetcher(source, api_key):
+    return tda_fetcher(api_key) if source == "TD_AMERITRADE" else yahoo_fetcher()
+
+def load_prices_with_fallback(securities, sources, api_key, info = {}):
+    """Loads every ticker from the first of sources and from the next one as well if it fails or takes longer than HEDGE_AFTER_SECONDS.
+    The first valid answer is kept, with its candles in the schema of get_yf_data."""
+    print(f'*** Loading Stocks from {" with fallback ".join(sources)} ***')
+    today = date.today()
+    keep_from = today - dt.timedelta(days=HISTORY_DAYS)
+    reduce = info.get("reduce")
+    previous = previous_prices(info)
+    fetchers = [(source, fetcher(source, api_key)) for source in sources]
+    # room for the requests that lost the race and are still running
+    executor = ThreadPoolExecutor(max_workers=2*FETCH_WORKERS*len(sources))
+
+    def load_ticker(sec):
+        ticker = sec["ticker"]
+        stored = previous.get(ticker, {}).get("candles")
+        since = refresh_start_date(previous, ticker, keep_from)
+        ticker_data, source, statuses = hedged_fetch(sec, since, fetchers, HEDGE_AFTER_SECONDS, executor)
+        if ticker_data is not None and stored and adjustment_changed(stored, ticker_data["candles"], since):
+            # the stored history has the old adjustment, the whole window is loaded again (or the stored candles kept if that fails)
+            ticker_data, source, statuses = hedged_fetch(sec, keep_from, fetchers, HEDGE_AFTER_SECONDS, executor)
+            stored = stored if ticker_data is None else None
+        rs_metrics.count("tickers_total", source=source or "none", status="ok" if source else "failed")
+        if ticker_data is None and not stored:
+            failures = ", ".join(f'{failed_source} ({status})' for failed_source, status in statuses.items())
+            return None, f' Failed on {failures}, not saved'
+        candles = normalize_candles(ticker_data["candles"]) if ticker_data else []
+        if stored:
+            candles = merge_candles(normalize_candles(stored), candles, since, keep_from)
+        ticker_data = {"candles": candles}
+        enrich_ticker_data(ticker_data, sec)
+        if source is None:
+            source_text = ' Failed, kept the stored candles'
+        else:
+            source_text = '' if source == sources[0] else f' via {source}'
+        return (reduce(ticker_data) if reduce else ticker_data), source_text
+
+    securities = list(securities)
+    if "TD_AMERITRADE" in sources:
+        load_ticker_info(securities)
+    try:
+        return save_prices(securities, "+".join(sources), info, lambda loaded, checkpoint: load_all(loaded, load_ticker, checkpoint=checkpoint))
+    finally:
+        executor.shutdown(wait=False)
 
 def get_yf_data(security, start_date, end_date):
         ticker_data = {}
         ticker = security["ticker"]
         escaped_ticker = escape_ticker(ticker)
-        df = yf.download(escaped_ticker, start=start_date, end=end_date, auto_adjust=True)
-        yahoo_response = df.to_dict()
-        timestamps = list(yahoo_response["Open"].keys())
-        timestamps = list(map(lambda timestamp: int(timestamp.timestamp()), timestamps))
-        opens = list(yahoo_response["Open"].values())
-        closes = list(yahoo_response["Close"].values())
-        lows = list(yahoo_response["Low"].values())
-        highs = list(yahoo_response["High"].values())
-        volumes = list(yahoo_response["Volume"].values())
-        candles = []
-
-        for i in range(0, len(opens)):
-            candle = {}
-            candle["open"] = opens[i]
-            candle["close"] = closes[i]
-            candle["low"] = lows[i]
-            candle["high"] = highs[i]
-            candle["volume"] = volumes[i]
-            candle["datetime"] = timestamps[i]
-            candles.append(candle)
-
-        ticker_data["candles"] = candles
+        # Ticker.history keeps no shared state, unlike yf.download, so it can be called from several workers
+        df = yf.Ticker(escaped_ticker).history(start=start_date, end=end_date, auto_adjust=True)
+        ticker_data["candles"] = candles_from_frame(df)
         enrich_ticker_data(ticker_data, security)
         return ticker_data
 
+def get_yf_batch_data(securities, start_date, end_date):
+    """Downloads several securities with one yahoo request.
+    Returns the ticker data keyed by ticker and the list of tickers without data."""
+    by_symbol = {escape_ticker(sec["ticker"]): sec for sec in securities}
+    df = yf.download(list(by_symbol), start=start_date, end=end_date, auto_adjust=True, group_by="ticker", threads=True, progress=False)
+    if not isinstance(df.columns, pd.MultiIndex):
+        # a single symbol comes back without the ticker level
+        df = pd.concat({next(iter(by_symbol)): df}, axis=1)
+    symbols = set(df.columns.get_level_values(0))
+    tickers_dict = {}
+    failed = []
+    for symbol, security in by_symbol.items():
+        candles = candles_from_frame(df[symbol]) if symbol in symbols else []
+        if len(candles) == 0:
+            failed.append(security["ticker"])
+            continue
+        ticker_data = {"candles": candles}
+        enrich_ticker_data(ticker_data, security)
+        tickers_dict[security["ticker"]] = ticker_data
+    return tickers_dict, failed
+
+def load_batches_from_yahoo(securities, start_date, end_date, batch_size, checkpoint, previous = {}, reduce = None):
+    """Appends the loaded tickers to the checkpoint. Without a checkpoint the tickers reduced by `reduce` are returned instead."""
+    if checkpoint:
+        securities = [sec for sec in securities if sec["ticker"] not in checkpoint["completed"]]
+    results = {}
+    batches = [securities[i:i+batch_size] for i in range(0, len(securities), batch_size)]
+    start = time.time()
+    estimate_remaining = rs_metrics.create_eta_estimator(len(batches))
+    for idx, batch in enumerate(batches):
+        r_start = time.time()
+        since = min(refresh_start_date(previous, sec["ticker"], start_date) for sec in batch)
+        try:
+            batch_dict, failed = get_yf_batch_data(batch, since, end_date)
+            status = "ok"
+        except Exception as e:
+            batch_dict, failed = {}, [sec["ticker"] for sec in batch]
+            status = "error"
+            print(f'Batch failed: {e}')
+        rs_metrics.observe_request("YAHOO_BATCH", time.time() - r_start, status)
+        rs_metrics.count("tickers_total", len(batch) - len(failed), source="YAHOO_BATCH", status="ok")
+        rs_metrics.count("tickers_total", len(failed), source="YAHOO_BATCH", status="empty")
+        for sec in batch:
+            ticker = sec["ticker"]
+            if ticker in previous:
+                ticker_data = batch_dict.setdefault(ticker, {"candles": []})
+                if adjustment_changed(previous[ticker]["candles"], ticker_data["candles"], refresh_start_date(previous, ticker, start_date)):
+                    # the stored history has the old adjustment, the whole window is loaded again
+                    reloaded = get_yf_data(sec, start_date, end_date)
+                    if reloaded["candles"]:
+                        batch_dict[ticker] = reloaded
+                        continue
+                    ticker_data["candles"] = []
+                ticker_data["candles"] = merge_candles(previous[ticker]["candles"], ticker_data["candles"], since, start_date)
+                enrich_ticker_data(ticker_data, sec)
+        for ticker, ticker_data in batch_dict.items():
+            if checkpoint:
+                append_checkpoint(checkpoint, ticker, ticker_data)
+            else:
+                results[ticker] = reduce(ticker_data)
+        remaining_seconds = estimate_remaining(time.time() - r_start)
+        error_text = f' Failed: {",".join(failed)}' if failed else ''
+        label = f'{batch[0]["ticker"]}..{batch[-1]["ticker"]}'
+        print_data_progress(label, f'batch of {len(batch)}', idx, batches, error_text, time.time() - start, remaining_seconds)
+    return {sec["ticker"]: results[sec["ticker"]] for sec in securities if sec["ticker"] in results}
+
 def load_prices_from_yahoo(securities, info = {}):
     print("*** Loading Stocks from Yahoo Finance ***")
     today = date.today()
-    start = time.time()
-    start_date = today - dt.timedelta(days=1*365+183) # 183 = 6 months
-    tickers_dict = {}
-    load_times = []
-    for idx, security in enumerate(securities):
+    start_date = today - dt.timedelta(days=HISTORY_DAYS)
+    reduce = info.get("reduce")
+    previous = previous_prices(info)
+    securities = list(securities)
+
+    if YAHOO_BATCH_SIZE > 1:
+        return save_prices(securities, "YAHOO", info, lambda loaded, checkpoint: load_batches_from_yahoo(loaded, start_date, today, YAHOO_BATCH_SIZE, checkpoint, previous, reduce))
+
+    fetch = yahoo_fetcher()
+
+    def load_ticker(security):
         ticker = security["ticker"]
-        r_start = time.time()
+        stored = previous.get(ticker, {}).get("candles")
+        since = refresh_start_date(previous, ticker, start_date)
+        ticker_data, _ = fetch(security, since)
+        if ticker_data is not None and stored and adjustment_changed(stored, ticker_data["candles"], since):
+            # the stored history has the old adjustment, the whole window is loaded again (or the stored candles kept if that fails)
+            reloaded, _ = fetch(security, start_date)
+            if reloaded is not None:
+                return (reduce(reloaded) if reduce else reloaded), " Adjusted, loaded again"
+            ticker_data = None
+        if ticker_data is None:
+            # tickers without candles are saved empty
+            ticker_data = {"candles": []}
+            enrich_ticker_data(ticker_data, security)
+        if ticker in previous:
+            ticker_data["candles"] = merge_candles(previous[ticker]["candles"], ticker_data["candles"], since, start_date)
+        return (reduce(ticker_data) if reduce else ticker_data), ""
+
+    return save_prices(securities, "YAHOO", info, lambda loaded, checkpoint: load_all(loaded, load_ticker, checkpoint=checkpoint))
+
+def read_price_series():
+    """Closes and timestamps of the stored price history for the data-quality pass"""
+    if PRICE_STORE == "BINARY":
+        return rs_quality.series_from_store(rs_store.read_price_store())
+    return rs_quality.series_from_dict(read_json(PRICE_DATA_FILE))
+
+def read_repaired():
+    try:
+        return read_json(REPAIRED_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def repair_needed(source):
+    """A full load from yahoo (auto_adjust) is adjusted to the latest split, so the repair could only change TDA prices or
+    history that INCREMENTAL_REFRESH kept from earlier days"""
+    return REPAIR_PRICE_DATA and (INCREMENTAL_REFRESH or "TD_AMERITRADE" in (source, FALLBACK_DATA_SOURCE))
+
+def repair_price_data():
+    """Loads the tickers that the data-quality pass flags again from yahoo (split adjusted) and replaces them in the stored price history.
+    The last candle of every ticker loaded again is kept in REPAIRED_FILE. Its history up to there is confirmed (e.g. a real move),
+    so it is only checked again from that candle on and only once it has newer candles."""
+    with rs_metrics.stage("quality"):
+        series = read_price_series()
+        repaired = read_repaired()
+        starts = [repaired.get(ticker, 0) for ticker in series["tickers"]]
+        issues = rs_quality.check(rs_quality.rows_since(series, starts))
+        last = rs_quality.last_timestamps(series)
+        for i, ticker in enumerate(series["tickers"]):
+            if ticker in issues and ticker in repaired and last[i] <= repaired[ticker]:
+                del issues[ticker]
+        # tickers that aren't stored anymore are forgotten
+        repaired = {ticker: repaired[ticker] for ticker in series["tickers"] if ticker in repaired}
+    if not issues:
+        write_to_file(repaired, REPAIRED_FILE)
+        print("No data issues found.")
+        return {}
+    print(f'*** Loading {len(issues)} flagged tickers again from Yahoo Finance ***')
+    rs_quality.print_issues(issues)
+    securities = []
+    for i, ticker in enumerate(series["tickers"]):
+        if ticker in issues:
+            security = {"ticker": ticker}
+            for field in rs_store.META_FIELDS:
+                security[field] = series[field][i]
+            securities.append(security)
+            repaired[ticker] = int(last[i])
+    # the store's memory maps aren't needed anymore
+    del series
+    today = date.today()
+    start_date = today - dt.timedelta(days=HISTORY_DAYS)
+
+    def load_ticker(security):
         ticker_data = get_yf_data(security, start_date, today)
-        # if not ticker in TICKER_INFO_DICT:
-        #     load_ticker_info(ticker, TICKER_INFO_DICT)
-        # ticker_data["industry"] = TICKER_INFO_DICT[ticker]["info"]["industry"]
-        now = time.time()
-        current_load_time = now - r_start
-        load_times.append(current_load_time)
-        remaining_seconds = remaining_seconds = get_remaining_seconds(load_times, idx, len(securities))
-        print_data_progress(ticker, security["universe"], idx, securities, "", time.time() - start, remaining_seconds)
-        tickers_dict[ticker] = ticker_data
-    write_price_history_file(tickers_dict)
+        if not ticker_data["candles"]:
+            return None, " No data, kept the stored candles"
+        return ticker_data, ""
+
+    with rs_metrics.stage("repair"):
+        replacements = load_all(securities, load_ticker)
+        if PRICE_STORE == "BINARY":
+            rs_store.replace_tickers(replacements)
+        elif replacements:
+            tickers_dict = read_json(PRICE_DATA_FILE)
+            tickers_dict.update(replacements)
+            write_price_history_file(tickers_dict)
+    for ticker, ticker_data in replacements.items():
+        repaired[ticker] = int(rs_store.timestamp_seconds(ticker_data["candles"][-1]["datetime"]))
+    write_to_file(repaired, REPAIRED_FILE)
+    still_flagged = rs_quality.check(rs_quality.series_from_dict(replacements))
+    rs_metrics.count("repaired_tickers_total", len(replacements))
+    print(f'Replaced {len(replacements)} tickers, {len(still_flagged)} of them are still flagged (e.g. real moves).')
+    return replacements
 
 def save_data(source, securities, api_key, info = {}):
+    if FALLBACK_DATA_SOURCE and FALLBACK_DATA_SOURCE != source:
+        return load_prices_with_fallback(securities, [source, FALLBACK_DATA_SOURCE], api_key, info)
     if source == "YAHOO":
-        load_prices_from_yahoo(securities, info)
+        return load_prices_from_yahoo(securities, info)
     elif source == "TD_AMERITRADE":
-        load_prices_from_tda(securities, api_key, info)
+        return load_prices_from_tda(securities, api_key, info)
 
 
-def main(forceTDA = False, api_key = API_KEY):
+def main(forceTDA = False, api_key = API_KEY, resume = False, shard = None):
+    dataSource = DATA_SOURCE if not forceTDA else "TD_AMERITRADE"
+    with rs_metrics.stage("universe"):
+        securities = load_securities()
+    if shard:
+        use_shard(shard)
+        securities = shard_securities(securities, shard)
+        print(f'Shard {shard[0]} of {shard[1]}: {len(securities)} securities.')
+    with rs_metrics.stage("fetch"):
+        save_data(dataSource, securities, api_key, {"forceTDA": forceTDA, "resume": resume})
+    # shards are checked after merging
+    if repair_needed(dataSource) and not shard:
+        repair_price_data()
+    # the cache isn't kept (e.g. CI), ticker_info.json is
+    rs_ticker_info.export_json()
+
+def stream_prices(window, forceTDA = False, api_key = API_KEY):
+    """Loads all securities and reduces each ticker to its last `window` closes as soon as it arrives, in the worker that loaded it.
+    Nothing is written to the price history or the checkpoint. Returns the price data by ticker like rs_ranking.load_price_data."""
     dataSource = DATA_SOURCE if not forceTDA else "TD_AMERITRADE"
-    save_data(dataSource, SECURITIES, api_key, {"forceTDA": forceTDA})
-    write_ticker_info_file(TICKER_INFO_DICT)
+    with rs_metrics.stage("universe"):
+        securities = load_securities()
+    with rs_metrics.stage("fetch"):
+        price_data = save_data(dataSource, securities, api_key, {"forceTDA": forceTDA, "reduce": lambda ticker_data: reduce_ticker(ticker_data, window)})
+    rs_ticker_info.export_json()
+    return price_data
+
+def merge_and_repair():
+    merge_shards()
+    if repair_needed(DATA_SOURCE):
+        repair_price_data()
+
+def arg_value(name):
+    """Value of a command line option given as `name value` or `name=value`"""
+    for idx, arg in enumerate(sys.argv):
+        if arg == name and idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return None
 
 if __name__ == "__main__":
-    main()
+    if "--offline" in sys.argv:
+        OFFLINE = True
+    shard = arg_value("--shard")
+    if "--repair" in sys.argv:
+        repair_price_data()
+    elif "--merge-shards" in sys.argv:
+        merge_and_repair()
+    else:
+        main(resume="--resume" in sys.argv, shard=parse_shard(shard) if shard else None)
+    rs_metrics.write_report()
@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import rs_metrics
+
+# statuses with which a provider says "slow down" or "try again later"
+RETRY_STATUS = (429, 500, 502, 503, 504)
+BACKOFF_CAP_S = 30
+TIMEOUT_S = 30
+
+def create_session(pool_size):
+    """Session that keeps up to pool_size connections alive, one per worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def create_rate_limiter(rate):
+    """Token bucket for `rate` requests per second shared by all workers, 0 means unlimited.
+    adapt_rate halves the rate when the provider pushes back and raises it step by step again afterwards."""
+    return {
+        "max_rate": rate,
+        "rate": rate,
+        "min_rate": rate / 16,
+        "tokens": 1.0,
+        "updated": time.monotonic(),
+        "paused_until": 0.0,
+        "lock": threading.Lock()
+    }
+
+def acquire(limiter):
+    """Blocks until a token is available"""
+    if not limiter or not limiter["max_rate"]:
+        return
+    while True:
+        with limiter["lock"]:
+            now = time.monotonic()
+            rate = limiter["rate"]
+            # bursts are limited to one second worth of requests
+            limiter["tokens"] = min(max(rate, 1.0), limiter["tokens"] + (now - limiter["updated"]) * rate)
+            limiter["updated"] = now
+            if now >= limiter["paused_until"] and limiter["tokens"] >= 1:
+                limiter["tokens"] = limiter["tokens"] - 1
+                return
+            wait_s = max(limiter["paused_until"] - now, (1 - limiter["tokens"]) / rate)
+        time.sleep(wait_s)
+
+def adapt_rate(limiter, status, retry_after_s = None):
+    """Additive increase, multiplicative decrease: halves the rate on 429/5xx and adds 5% of the configured rate on success"""
+    if not limiter or not limiter["max_rate"]:
+        return
+    with limiter["lock"]:
+        if status in RETRY_STATUS:
+            limiter["rate"] = max(limiter["min_rate"], limiter["rate"] / 2)
+            limiter["tokens"] = min(limiter["tokens"], 0.0)
+            if retry_after_s:
+                limiter["paused_until"] = max(limiter["paused_until"], time.monotonic() + retry_after_s)
+        elif status == 200:
+            limiter["rate"] = min(limiter["max_rate"], limiter["rate"] + limiter["max_rate"] / 20)
+
+def backoff_seconds(attempt, base_s, cap_s = BACKOFF_CAP_S):
+    """Exponential backoff with full jitter, so retrying workers don't hit the provider at the same time"""
+    return random.uniform(0, min(cap_s, base_s * 2**attempt))
+
+def retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def get_json(session, url, params = None, headers = None, limiter = None, retries = 3, backoff_s = 0.5, source = "HTTP"):
+    """GETs url and returns (payload, status). 429, 5xx, invalid JSON and connection errors are retried with backoff.
+    The payload is None if the last attempt failed, status is then the last HTTP status or the name of the error."""
+    status = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(backoff_seconds(attempt - 1, backoff_s))
+        acquire(limiter)
+        r_start = time.time()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=TIMEOUT_S)
+            status = response.status_code
+        except requests.RequestException as e:
+            response = None
+            status = type(e).__name__
+        rs_metrics.observe_request(source, time.time() - r_start, status)
+        adapt_rate(limiter, status, retry_after_seconds(response) if response is not None else None)
+        if status == 200:
+            try:
+                return response.json(), status
+            except ValueError:
+                status = "InvalidJSON"
+                continue
+        if response is not None and status not in RETRY_STATUS:
+            break
+    return None, status
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from rs_config import cfg
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+METRICS_FORMAT = cfg("METRICS_FORMAT")
+REPORT_FILE = os.path.join(DIR, "output", "run_report.json")
+PROMETHEUS_FILE = os.path.join(DIR, "output", "metrics.prom")
+PREFIX = "rs_"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_started = time.time()
+_stages = {}
+_counters = {}
+_histograms = {}
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+@contextmanager
+def stage(name):
+    """Adds the time spent in the block to the stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            entry = _stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] = entry["seconds"] + seconds
+            entry["calls"] = entry["calls"] + 1
+
+def count(name, value = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, buckets = LATENCY_BUCKETS, **labels):
+    """Adds value to a histogram with fixed bucket bounds"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, {"bounds": buckets, "buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(histogram["bounds"]):
+            if value <= bound:
+                histogram["buckets"][i] = histogram["buckets"][i] + 1
+                break
+        histogram["sum"] = histogram["sum"] + value
+        histogram["count"] = histogram["count"] + 1
+
+def observe_request(source, seconds, status):
+    observe("request_seconds", seconds, source=source)
+    count("requests_total", source=source, status=status)
+
+def create_eta_estimator(total, workers = 1, window = 25):
+    """Returns a function that takes the load time of one more item and returns the estimated remaining seconds.
+    Uses an exponential moving average, so each update is constant time."""
+    alpha = 2 / (window + 1)
+    state = {"done": 0, "average": None}
+    lock = threading.Lock()
+    def update(load_time):
+        with lock:
+            state["done"] = state["done"] + 1
+            if state["average"] is None:
+                state["average"] = load_time
+            else:
+                state["average"] = state["average"] + alpha * (load_time - state["average"])
+            return (total - state["done"]) * state["average"] / workers
+    return update
+
+def report():
+    """All metrics as a dict"""
+    with _lock:
+        histograms = []
+        for (name, labels), histogram in _histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(histogram["bounds"], histogram["buckets"]):
+                cumulative = cumulative + bucket_count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = histogram["count"]
+            histograms.append({"name": name, "labels": dict(labels), "buckets": buckets, "sum": histogram["sum"], "count": histogram["count"]})
+        return {
+            "started": datetime.fromtimestamp(_started).isoformat(),
+            "finished": datetime.now().isoformat(),
+            "stages": {name: dict(entry) for name, entry in _stages.items()},
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()],
+            "histograms": histograms
+        }
+
+def _labels_text(labels, extra = None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in items) + "}"
+
+def prometheus_text(run_report):
+    lines = [f'# TYPE {PREFIX}stage_seconds gauge']
+    for name, entry in run_report["stages"].items():
+        lines.append(f'{PREFIX}stage_seconds{{stage="{name}"}} {entry["seconds"]}')
+    counter_names = sorted(set(counter["name"] for counter in run_report["counters"]))
+    for name in counter_names:
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        for counter in run_report["counters"]:
+            if counter["name"] == name:
+                lines.append(f'{PREFIX}{name}{_labels_text(counter["labels"])} {counter["value"]}')
+    histogram_names = sorted(set(histogram["name"] for histogram in run_report["histograms"]))
+    for name in histogram_names:
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for histogram in run_report["histograms"]:
+            if histogram["name"] != name:
+                continue
+            for bound, bucket_count in histogram["buckets"].items():
+                lines.append(f'{PREFIX}{name}_bucket{_labels_text(histogram["labels"], {"le": bound})} {bucket_count}')
+            lines.append(f'{PREFIX}{name}_sum{_labels_text(histogram["labels"])} {histogram["sum"]}')
+            lines.append(f'{PREFIX}{name}_count{_labels_text(histogram["labels"])} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
+
+def _write_atomic(file, text):
+    tmp_file = file + ".tmp"
+    with open(tmp_file, "w", encoding="utf8") as fp:
+        fp.write(text)
+    os.replace(tmp_file, file)
+
+def write_report(metrics_format = None):
+    """Writes the metrics as JSON run report and/or Prometheus textfile, depending on METRICS_FORMAT (JSON, PROMETHEUS or BOTH)"""
+    metrics_format = metrics_format or METRICS_FORMAT
+    if not metrics_format:
+        return
+    run_report = report()
+    for file in (REPORT_FILE, PROMETHEUS_FILE):
+        if not os.path.exists(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+    if metrics_format in ("JSON", "BOTH"):
+        _write_atomic(REPORT_FILE, json.dumps(run_report, indent=2))
+    if metrics_format in ("PROMETHEUS", "BOTH"):
+        _write_atomic(PROMETHEUS_FILE, prometheus_text(run_report))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Data-quality pass over the stored closes. Flags split-like jumps, invalid closes, gaps and stale series of all tickers at once.
+`rs_data.py --repair` loads the flagged tickers again from yahoo (split adjusted) and patches the stored price history.
+
+    python rs_quality.py   # only lists the flagged tickers
+"""
+import numpy as np
+from rs_config import cfg
+import rs_store
+
+DAY_S = 24*60*60
+# a close that is that many times the previous one (or that part of it) looks like a split
+QUALITY_MAX_DAILY_MOVE = cfg("QUALITY_MAX_DAILY_MOVE") or 1.8
+QUALITY_MAX_GAP_DAYS = cfg("QUALITY_MAX_GAP_DAYS") or 10
+QUALITY_STALE_DAYS = cfg("QUALITY_STALE_DAYS") or 5
+QUALITY_FLAT_DAYS = cfg("QUALITY_FLAT_DAYS") or 10
+
+def series_from_store(store):
+    """Closes and timestamps of all tickers as concatenated arrays, rows offsets[i]:offsets[i+1] belong to the i-th ticker"""
+    series = {
+        "tickers": store["tickers"],
+        "offsets": np.asarray(store["offsets"]),
+        "timestamps": store["dates"][store["date_index"]],
+        "closes": np.asarray(store["close"])
+    }
+    for field in rs_store.META_FIELDS:
+        series[field] = store[field]
+    return series
+
+def series_from_dict(tickers_dict):
+    tickers = [ticker for ticker in tickers_dict]
+    candles = [tickers_dict[ticker].get("candles") or [] for ticker in tickers]
+    offsets = np.zeros(len(tickers) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ticker_candles) for ticker_candles in candles])
+    series = {
+        "tickers": tickers,
+        "offsets": offsets,
+        "timestamps": np.array([rs_store.timestamp_seconds(candle["datetime"]) for ticker_candles in candles for candle in ticker_candles], dtype=np.int64),
+        "closes": np.array([candle["close"] for ticker_candles in candles for candle in ticker_candles], dtype=np.float64)
+    }
+    for field in rs_store.META_FIELDS:
+        series[field] = [tickers_dict[ticker].get(field) for ticker in tickers]
+    return series
+
+def rows_since(series, starts):
+    """The series with only the rows of the i-th ticker from the timestamp starts[i] on (0 keeps all its rows)"""
+    offsets = series["offsets"]
+    counts = np.diff(offsets)
+    ticker_rows = np.repeat(np.arange(len(counts)), counts)
+    keep = series["timestamps"] >= np.asarray(starts, dtype=np.int64)[ticker_rows]
+    result = dict(series)
+    result["offsets"] = np.zeros(len(offsets), dtype=np.int64)
+    result["offsets"][1:] = np.cumsum(np.bincount(ticker_rows[keep], minlength=len(counts)))
+    result["timestamps"] = series["timestamps"][keep]
+    result["closes"] = series["closes"][keep]
+    return result
+
+def last_timestamps(series):
+    """Timestamp of the last candle of every ticker, 0 for tickers without candles"""
+    starts = series["offsets"][:-1]
+    ends = series["offsets"][1:]
+    if not len(series["timestamps"]):
+        return np.zeros(len(starts), dtype=np.int64)
+    return np.where(ends > starts, series["timestamps"][np.maximum(ends - 1, 0)], 0)
+
+def _per_series(values, starts, nonempty, reduce, empty_value):
+    """reduce over the rows of each series, empty series get empty_value"""
+    result = np.full(len(starts), empty_value, dtype=values.dtype)
+    if nonempty.any():
+        result[nonempty] = reduce.reduceat(values, starts[nonempty])
+    return result
+
+def check(series, max_move = None, max_gap_days = None, stale_days = None, flat_days = None):
+    """Returns the list of issues by flagged ticker"""
+    max_move = max_move or QUALITY_MAX_DAILY_MOVE
+    max_gap_days = max_gap_days or QUALITY_MAX_GAP_DAYS
+    stale_days = stale_days or QUALITY_STALE_DAYS
+    flat_days = flat_days or QUALITY_FLAT_DAYS
+    offsets = series["offsets"]
+    closes = series["closes"]
+    timestamps = series["timestamps"]
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    counts = ends - starts
+    nonempty = counts > 0
+    # the first row of a series has no previous close
+    first_row = np.zeros(len(closes), dtype=bool)
+    first_row[starts[nonempty]] = True
+
+    invalid = ~(closes > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moves = np.ones(len(closes))
+        moves[1:] = closes[1:] / closes[:-1]
+        moves = np.maximum(moves, 1 / moves)
+    moves[first_row | invalid | np.roll(invalid, 1)] = 1
+    gaps = np.zeros(len(closes), dtype=np.int64)
+    gaps[1:] = np.diff(timestamps)
+    gaps[first_row] = 0
+
+    max_moves = _per_series(moves, starts, nonempty, np.maximum, 1.0)
+    max_gaps = _per_series(gaps, starts, nonempty, np.maximum, 0)
+    invalid_counts = _per_series(invalid.astype(np.int64), starts, nonempty, np.add, 0)
+    last = np.where(nonempty, timestamps[np.maximum(ends - 1, 0)] if len(timestamps) else 0, 0)
+    newest = timestamps.max() if len(timestamps) else 0
+    # the last flat_days closes are all the same
+    long_enough = counts >= flat_days
+    flat = np.zeros(len(counts), dtype=bool)
+    if long_enough.any():
+        rows = ends[long_enough, None] - 1 - np.arange(flat_days)[None, :]
+        flat[long_enough] = (closes[rows] == closes[rows[:, :1]]).all(axis=1)
+
+    issues = {}
+    def flag(mask, describe):
+        for i in np.flatnonzero(mask):
+            issues.setdefault(series["tickers"][i], []).append(describe(i))
+    flag(~nonempty, lambda i: "no candles")
+    flag(invalid_counts > 0, lambda i: f'{invalid_counts[i]} invalid closes')
+    flag(max_moves > max_move, lambda i: f'jump x{max_moves[i]:.2f}')
+    flag(max_gaps > max_gap_days*DAY_S, lambda i: f'gap of {max_gaps[i] // DAY_S} days')
+    flag(nonempty & (newest - last > stale_days*DAY_S), lambda i: f'last candle {(newest - last[i]) // DAY_S} days old')
+    flag(flat, lambda i: f'last {flat_days} closes unchanged')
+    return issues
+
+def print_issues(issues):
+    for ticker, ticker_issues in issues.items():
+        print(f'{ticker}: {", ".join(ticker_issues)}')
+    print(f'{len(issues)} tickers flagged.')
+
+def main():
+    # imported here as rs_data imports this module
+    import rs_data
+    print_issues(check(rs_data.read_price_series()))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 import sys
+import cProfile
 import pandas as pd
 import numpy as np
 import json
 import os
-from datetime import date
-from scipy.stats import linregress
-import yaml
-from rs_data import TD_API, cfg, read_json
-from functools import reduce
+from datetime import date, datetime
+from rs_config import cfg, read_json
+import rs_archive
+import rs_metrics
+import rs_store
+import rs_ticker_info
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -15,72 +17,160 @@ pd.set_option('display.max_rows', None)
 pd.set_option('display.width', None)
 pd.set_option('display.max_columns', None)
 
-try:
-    with open('config.yaml', 'r') as stream:
-        config = yaml.safe_load(stream)
-except FileNotFoundError:
-    config = None
-except yaml.YAMLError as exc:
-        print(exc)
-
 PRICE_DATA = os.path.join(DIR, "data", "price_history.json")
+PRICE_STORE = cfg("PRICE_STORE") or "JSON"
+BACKFILL_DAYS = cfg("BACKFILL_DAYS") or 252
+ARCHIVE_RANKINGS = cfg("ARCHIVE_RANKINGS")
+BACKFILL_FILE = os.path.join(DIR, "output", "rs_history.npz")
+# not in output, which is published as is
+BREAKPOINTS_FILE = os.path.join(DIR, "data", "rs_breakpoints%s.npz")
+PROFILE_FILE = os.path.join(DIR, "output", "rs_ranking.prof")
 MIN_PERCENTILE = cfg("MIN_PERCENTILE")
 POS_COUNT_TARGET = cfg("POSITIONS_COUNT_TARGET")
-REFERENCE_TICKER = cfg("REFERENCE_TICKER")
+# the first reference gets the unsuffixed outputs, every other one outputs with its ticker as suffix
+REFERENCE_TICKERS = cfg("REFERENCE_TICKERS") or [cfg("REFERENCE_TICKER")]
+REFERENCE_TICKER = REFERENCE_TICKERS[0]
 ALL_STOCKS = cfg("USE_ALL_LISTED_STOCKS")
-TICKER_INFO_FILE = os.path.join(DIR, "data_persist", "ticker_info.json")
-TICKER_INFO_DICT = read_json(TICKER_INFO_FILE)
 
 TITLE_RANK = "Rank"
 TITLE_TICKER = "Ticker"
 TITLE_TICKERS = "Tickers"
 TITLE_SECTOR = "Sector"
 TITLE_INDUSTRY = "Industry"
+TITLE_INDUSTRIES = "Industries"
 TITLE_UNIVERSE = "Universe" if not ALL_STOCKS else "Exchange"
 TITLE_PERCENTILE = "Percentile"
 TITLE_1M = "1 Month Ago"
 TITLE_3M = "3 Months Ago"
 TITLE_6M = "6 Months Ago"
 TITLE_RS = "Relative Strength"
+# percentile columns of the stocks and the relative strength they are calculated from
+PERCENTILE_COLUMNS = ((TITLE_PERCENTILE, TITLE_RS), (TITLE_1M, TITLE_1M), (TITLE_3M, TITLE_3M), (TITLE_6M, TITLE_6M))
+
+DAY_S = 24*60*60
+MONTH = 20
+QUARTER = int(252/4)
+LOOK_BACK_MONTHS = (0, 1, 3, 6)
+# closes needed for the strength of 6 months ago
+HISTORY = 4*QUARTER + 6*MONTH
 
 if not os.path.exists('output'):
     os.makedirs('output')
 
-def relative_strength(closes: pd.Series, closes_ref: pd.Series):
-    rs_stock = strength(closes)
-    rs_ref = strength(closes_ref)
-    rs = (1 + rs_stock) / (1 + rs_ref) * 100
-    rs = int(rs*100) / 100 # round to 2 decimals
-    return rs
+def closes_matrix(closes_list, width = HISTORY):
+    """Right aligns the last `width` closes of every series in one array. Missing history is NaN."""
+    matrix = np.full((len(closes_list), width), np.nan)
+    for i, closes in enumerate(closes_list):
+        tail = np.asarray(closes[-width:], dtype=np.float64)
+        if len(tail) > 0:
+            matrix[i, width-len(tail):] = tail
+    return matrix
 
-def strength(closes: pd.Series):
-    """Calculates the performance of the last year (most recent quarter is weighted double)"""
-    try:
-        quarters1 = quarters_perf(closes, 1)
-        quarters2 = quarters_perf(closes, 2)
-        quarters3 = quarters_perf(closes, 3)
-        quarters4 = quarters_perf(closes, 4)
-        return 0.4*quarters1 + 0.2*quarters2 + 0.2*quarters3 + 0.2*quarters4
-    except:
-        return 0
-
-def quarters_perf(closes: pd.Series, n):
-    length = min(len(closes), n*int(252/4))
-    prices = closes.tail(length)
-    pct_chg = prices.pct_change().dropna()
-    perf_cum = (pct_chg + 1).cumprod() - 1
-    return perf_cum.tail(1).item()
-
-
-def rankings():
-    """Returns a dataframe with percentile rankings for relative strength"""
+def date_axis(ref_timestamps, timestamps_list, width):
+    """The last `width` days (days since 1970) of the reference. If the reference has less history, the days of the other series before its first day come first."""
+    axis = np.asarray(ref_timestamps, dtype=np.int64) // DAY_S
+    if len(axis) < width:
+        earlier = np.unique(np.concatenate([np.asarray(timestamps, dtype=np.int64) // DAY_S for timestamps in timestamps_list]))
+        axis = np.concatenate([earlier[earlier < axis[0]] if len(axis) else earlier, axis])
+    return axis[-width:]
+
+def aligned_closes_matrix(closes_list, timestamps_list, axis):
+    """Puts the closes of every series in the column of their day on the date axis (days since 1970), NaN where a series has no close.
+    Closes of days that aren't on the axis are left out."""
+    matrix = np.full((len(closes_list), len(axis)), np.nan)
+    for i, (closes, timestamps) in enumerate(zip(closes_list, timestamps_list)):
+        days = np.asarray(timestamps, dtype=np.int64) // DAY_S
+        cols = np.searchsorted(axis, days)
+        on_axis = cols < len(axis)
+        on_axis[on_axis] = axis[cols[on_axis]] == days[on_axis]
+        matrix[i, cols[on_axis]] = np.asarray(closes, dtype=np.float64)[on_axis]
+    return matrix
+
+def strengths(matrix, end):
+    """Performance of the last year (most recent quarter weighted double) of every row of a closes_matrix, using the columns before `end`.
+    Gaps are forward filled, like pct_change does in the pinned pandas version, and rows with less than two closes get 0."""
+    width = matrix.shape[1]
+    cols = np.arange(width)
+    valid = ~np.isnan(matrix)
+    # index of the next valid close at or after each column
+    next_valid = np.where(valid, cols, width)
+    next_valid = np.minimum.accumulate(next_valid[:, ::-1], axis=1)[:, ::-1]
+    # forward fill gaps
+    filled = matrix[np.arange(len(matrix))[:, None], np.maximum.accumulate(np.where(valid, cols, 0), axis=1)]
+    ratios = np.full(matrix.shape, np.nan)
+    ratios[:, 1:] = (filled[:, 1:] / filled[:, :-1] - 1) + 1
+    first = np.minimum(next_valid[:, 0], end)
+    perfs = []
+    for n in range(1, 5):
+        length = np.minimum(end - first, n*QUARTER)
+        start = end - length
+        first_in_window = next_valid[np.arange(len(matrix)), np.minimum(start, width-1)]
+        used = (cols < end) & (cols > start[:, None]) & (cols > first_in_window[:, None]) & ~np.isnan(ratios)
+        perf = np.cumprod(np.where(used, ratios, 1.0), axis=1)[:, -1] - 1
+        # less than two closes in the window, the strength falls back to 0
+        perf[~used.any(axis=1)] = np.nan
+        perfs.append(perf)
+    result = 0.4*perfs[0] + 0.2*perfs[1] + 0.2*perfs[2] + 0.2*perfs[3]
+    return np.where(np.isnan(result), 0, result)
+
+def strength_table(matrix):
+    """`strengths` of all rows of a closes_matrix now and for LOOK_BACK_MONTHS ago, one column each"""
+    return np.column_stack([strengths(matrix, matrix.shape[1] - months*MONTH) for months in LOOK_BACK_MONTHS])
+
+def relative_strength_table(matrix, ref_row = 0, strength_all = None):
+    """Relative strength of all rows of a closes_matrix now and for LOOK_BACK_MONTHS ago, compared to the reference row.
+    Pass the strength_table to compare against several reference rows without computing the strengths again."""
+    strength_all = strength_table(matrix) if strength_all is None else strength_all
+    rs = (1 + strength_all) / (1 + strength_all[ref_row]) * 100
+    return np.trunc(rs*100) / 100 # round to 2 decimals
+
+def rolling_strengths(matrix, days):
+    """`strengths` of every row of a closes_matrix for each of its last `days` columns as the most recent close.
+    Uses the ratio of last and first close of each quarter window instead of the cumulative product, so the results can differ from `strengths` in the last bits.
+    Days where a row has less than 6 months of history are NaN."""
+    width = matrix.shape[1]
+    rows = np.arange(len(matrix))[:, None]
+    cols = np.arange(width)
+    valid = ~np.isnan(matrix)
+    filled = matrix[rows, np.maximum.accumulate(np.where(valid, cols, 0), axis=1)]
+    first = np.where(valid.any(axis=1), valid.argmax(axis=1), width)
+    ends = cols[width-days:]
+    result = 0
+    for n, weight in ((1, 0.4), (2, 0.2), (3, 0.2), (4, 0.2)):
+        starts = np.minimum(np.maximum(ends[None, :] - (n*QUARTER-1), first[:, None]), width-1)
+        result = result + weight*(filled[:, ends] / filled[rows, starts] - 1)
+    history = ends[None, :] - first[:, None] + 1
+    return np.where(history >= 6*MONTH, result, np.nan)
+
+def load_price_data(with_timestamps = False):
+    """Returns the closes, the timestamp of the last candle and the stock info by ticker.
+    Closes of the binary store are read lazily from the memory-mapped arrays."""
+    if PRICE_STORE == "BINARY":
+        store = rs_store.read_price_store()
+        timestamps = store["dates"][store["date_index"]] if with_timestamps else None
+        price_data = {}
+        for i, ticker in enumerate(store["tickers"]):
+            price_data[ticker] = {field: store[field][i] for field in rs_store.META_FIELDS}
+            price_data[ticker]["closes"] = rs_store.ticker_closes(store, ticker)
+            rows = rs_store.ticker_rows(store, ticker)
+            price_data[ticker]["last_timestamp"] = int(store["dates"][store["date_index"][rows.stop - 1]]) if rows.stop > rows.start else None
+            if with_timestamps:
+                price_data[ticker]["timestamps"] = timestamps[rs_store.ticker_rows(store, ticker)]
+        return price_data
     json = read_json(PRICE_DATA)
-    relative_strengths = []
-    ranks = []
-    industries = {}
-    ind_ranks = []
-    stock_rs = {}
-    ref = json[REFERENCE_TICKER]
+    for ticker in json:
+        if "candles" in json[ticker]:
+            json[ticker]["closes"] = list(map(lambda candle: candle["close"], json[ticker]["candles"]))
+            json[ticker]["last_timestamp"] = rs_store.timestamp_seconds(json[ticker]["candles"][-1]["datetime"]) if json[ticker]["candles"] else None
+            if with_timestamps:
+                json[ticker]["timestamps"] = [rs_store.timestamp_seconds(candle["datetime"]) for candle in json[ticker]["candles"]]
+    return json
+
+def rankable_stocks(json):
+    """Returns (ticker, sector, industry, closes) of all stocks that are ranked"""
+    candidates = []
+    unknown = [ticker for ticker in json if json[ticker].get("industry") == "unknown" or json[ticker].get("sector") == "unknown"]
+    ticker_infos = rs_ticker_info.get_ticker_infos(unknown)
     for ticker in json:
         if not cfg("SP500") and json[ticker]["universe"] == "S&P 500":
             continue
@@ -91,107 +181,239 @@ def rankings():
         if not cfg("NQ100") and json[ticker]["universe"] == "Nasdaq 100":
             continue
         try:
-            closes = list(map(lambda candle: candle["close"], json[ticker]["candles"]))
-            closes_ref = list(map(lambda candle: candle["close"], ref["candles"]))
-            industry = TICKER_INFO_DICT[ticker]["info"]["industry"] if json[ticker]["industry"] == "unknown" else json[ticker]["industry"]
-            sector = TICKER_INFO_DICT[ticker]["info"]["sector"] if json[ticker]["sector"] == "unknown" else json[ticker]["sector"]
-            if len(closes) >= 6*20 and industry != "n/a" and len(industry.strip()) > 0:
-                closes_series = pd.Series(closes)
-                closes_ref_series = pd.Series(closes_ref)
-                rs = relative_strength(closes_series, closes_ref_series)
-                month = 20
-                tmp_percentile = 100
-                rs1m = relative_strength(closes_series.head(-1*month), closes_ref_series.head(-1*month))
-                rs3m = relative_strength(closes_series.head(-3*month), closes_ref_series.head(-3*month))
-                rs6m = relative_strength(closes_series.head(-6*month), closes_ref_series.head(-6*month))
-
-                # if rs is too big assume there is faulty price data
-                if rs < 600:
-                    # stocks output
-                    ranks.append(len(ranks)+1)
-                    relative_strengths.append((0, ticker, sector, industry, json[ticker]["universe"], rs, tmp_percentile, rs1m, rs3m, rs6m))
-                    stock_rs[ticker] = rs
-
-                    # industries output
-                    if industry not in industries:
-                        industries[industry] = {
-                            "info": (0, industry, sector, 0, 99, 1, 3, 6),
-                            TITLE_RS: [],
-                            TITLE_1M: [],
-                            TITLE_3M: [],
-                            TITLE_6M: [],
-                            TITLE_TICKERS: []
-                        }
-                        ind_ranks.append(len(ind_ranks)+1)
-                    industries[industry][TITLE_RS].append(rs)
-                    industries[industry][TITLE_1M].append(rs1m)
-                    industries[industry][TITLE_3M].append(rs3m)
-                    industries[industry][TITLE_6M].append(rs6m)
-                    industries[industry][TITLE_TICKERS].append(ticker)
+            closes = json[ticker]["closes"]
+            industry = ticker_infos[ticker]["industry"] if json[ticker]["industry"] == "unknown" else json[ticker]["industry"]
+            sector = ticker_infos[ticker]["sector"] if json[ticker]["sector"] == "unknown" else json[ticker]["sector"]
+            if len(closes) >= 6*MONTH and industry != "n/a" and len(industry.strip()) > 0:
+                candidates.append((ticker, sector, industry, closes))
         except KeyError:
             print(f'Ticker {ticker} has corrupted data.')
-    dfs = []
-    suffix = ''
+    return candidates
 
-    # stocks
-    df = pd.DataFrame(relative_strengths, columns=[TITLE_RANK, TITLE_TICKER, TITLE_SECTOR, TITLE_INDUSTRY, TITLE_UNIVERSE, TITLE_RS, TITLE_PERCENTILE, TITLE_1M, TITLE_3M, TITLE_6M])
-    df[TITLE_PERCENTILE] = pd.qcut(df[TITLE_RS], 100, labels=False, duplicates="drop")
+def group_rankings(df_rs, key, info_columns = ()):
+    """Ranks groups of stocks (e.g. industries) by the average relative strength of their stocks, computed in one grouped pass.
+    Groups with only one stock are left out. Info columns are taken from the first stock of each group."""
+    codes, groups = pd.factorize(df_rs[key])
+    counts = np.bincount(codes, minlength=len(groups))
+    first_rows = df_rs.drop_duplicates(key).set_index(key)
+    df = pd.DataFrame({TITLE_RANK: 0, key: groups})
+    for column in info_columns:
+        df[column] = df[key].map(first_rows[column])
+    for column in (TITLE_RS, TITLE_1M, TITLE_3M, TITLE_6M):
+        # bincount adds up in stock order, the same order the averages were always summed in
+        average = np.bincount(codes, weights=df_rs[column].to_numpy(dtype=np.float64), minlength=len(groups)) / counts
+        df[column] = np.trunc(average*100) / 100 # round to 2 decimals
+    # remove groups with only one stock
+    df = df[counts > 1].reset_index(drop=True)
+    df.insert(len(info_columns) + 3, TITLE_PERCENTILE, pd.qcut(df[TITLE_RS], 100, labels=False, duplicates="drop"))
     df[TITLE_1M] = pd.qcut(df[TITLE_1M], 100, labels=False, duplicates="drop")
     df[TITLE_3M] = pd.qcut(df[TITLE_3M], 100, labels=False, duplicates="drop")
     df[TITLE_6M] = pd.qcut(df[TITLE_6M], 100, labels=False, duplicates="drop")
     df = df.sort_values(([TITLE_RS]), ascending=False)
-    df[TITLE_RANK] = ranks
-    out_tickers_count = 0
-    for index, row in df.iterrows():
-        if row[TITLE_PERCENTILE] >= MIN_PERCENTILE:
-            out_tickers_count = out_tickers_count + 1
-    df = df.head(out_tickers_count)
-
-    df.to_csv(os.path.join(DIR, "output", f'rs_stocks{suffix}.csv'), index = False)
+    df[TITLE_RANK] = list(range(1, len(df)+1))
+    return df
+
+def ranked_members(df, key, member):
+    """Comma separated members of each group, strongest first"""
+    df = df.sort_values(TITLE_RS, ascending=False, kind="mergesort")
+    return df.groupby(key, sort=False)[member].agg(",".join)
+
+def rankings(price_data = None):
+    """Returns a dataframe with percentile rankings for relative strength"""
+    return rankings_by_reference(price_data)[REFERENCE_TICKER]
+
+def rankings_by_reference(price_data = None):
+    """Ranks the stocks against every ticker in REFERENCE_TICKERS and writes the outputs.
+    Returns the ranked stocks (from MIN_PERCENTILE on), industries and sectors by reference ticker."""
+    with rs_metrics.stage("load"):
+        price_data = load_price_data() if price_data is None else price_data
+    # the closes of a weekend run, or a run before the next close, are still the ones of the last trading day
+    day = last_candle_day(price_data.get(REFERENCE_TICKER, {}))
+    ranks = {}
+    for ticker, (df, df_industries, df_sectors, breakpoints) in rank_all(price_data).items():
+        suffix = '' if ticker == REFERENCE_TICKER else f'_{ticker}'
+        if ARCHIVE_RANKINGS:
+            with rs_metrics.stage("archive"):
+                # all stocks, so the history has no holes where a stock was below MIN_PERCENTILE
+                rs_archive.write_partition(df, f'stocks{suffix}', TITLE_TICKER, day)
+                rs_archive.write_partition(df_industries, f'industries{suffix}', TITLE_INDUSTRY, day)
+                rs_archive.write_partition(df_sectors, f'sectors{suffix}', TITLE_SECTOR, day)
+        df = df[df[TITLE_PERCENTILE] >= MIN_PERCENTILE]
+        with rs_metrics.stage("csv_write"):
+            df.to_csv(os.path.join(DIR, "output", f'rs_stocks{suffix}.csv'), index = False)
+            df_industries.to_csv(os.path.join(DIR, "output", f'rs_industries{suffix}.csv'), index = False)
+            df_sectors.to_csv(os.path.join(DIR, "output", f'rs_sectors{suffix}.csv'), index = False)
+            write_breakpoints(breakpoints, ticker)
+        ranks[ticker] = [df, df_industries, df_sectors]
+    return ranks
+
+def last_candle_day(ticker_data):
+    """Day of the last candle of a ticker of load_price_data, None if it has none"""
+    if ticker_data.get("last_timestamp") is None:
+        return None
+    return datetime.utcfromtimestamp(int(ticker_data["last_timestamp"])).date()
+
+def rank_all(price_data = None):
+    """Ranks all stocks against every ticker in REFERENCE_TICKERS. The strengths are calculated once, each reference only adds the division.
+    Ranks the stored price data or price_data already in memory (e.g. from rs_data.stream_prices).
+    Returns the ranked stocks (without the MIN_PERCENTILE cut), industries, sectors and percentile breakpoints by reference ticker."""
+    with rs_metrics.stage("load"):
+        json = load_price_data() if price_data is None else price_data
+        references = [ticker for ticker in REFERENCE_TICKERS if ticker == REFERENCE_TICKER or ticker in json]
+        for ticker in REFERENCE_TICKERS:
+            if ticker not in references:
+                print(f'Reference ticker {ticker} has no price data.')
+        refs = [json[ticker] for ticker in references]
+        # only the first reference is ranked as a stock, like with a single reference. The others would form a "--- Reference ---" industry and sector.
+        candidates = [candidate for candidate in rankable_stocks(json) if candidate[0] == REFERENCE_TICKER or candidate[0] not in REFERENCE_TICKERS]
+
+    with rs_metrics.stage("compute"):
+        matrix = closes_matrix([ref["closes"] for ref in refs] + [candidate[3] for candidate in candidates])
+        strength_all = strength_table(matrix)
+    rs_metrics.count("ranked_stocks_total", len(candidates))
+
+    ranks = {}
+    for ref_row, ticker in enumerate(references):
+        with rs_metrics.stage("compute"):
+            rs_table = relative_strength_table(matrix, ref_row, strength_all).tolist()[len(refs):]
+        ranks[ticker] = rank_tables(json, candidates, rs_table)
+    return ranks
+
+def rank_tables(json, candidates, rs_table):
+    """Ranks stocks, industries and sectors by the relative strengths of rs_table. The percentile breakpoints of the stocks come last."""
+    relative_strengths = []
+    with rs_metrics.stage("compute"):
+        for (ticker, sector, industry, closes), (rs, rs1m, rs3m, rs6m) in zip(candidates, rs_table):
+            tmp_percentile = 100
+            # if rs is too big assume there is faulty price data
+            if rs < 600:
+                relative_strengths.append((0, ticker, sector, industry, json[ticker]["universe"], rs, tmp_percentile, rs1m, rs3m, rs6m))
+    dfs = []
+
+    # stocks
+    with rs_metrics.stage("compute"):
+        df_rs = pd.DataFrame(relative_strengths, columns=[TITLE_RANK, TITLE_TICKER, TITLE_SECTOR, TITLE_INDUSTRY, TITLE_UNIVERSE, TITLE_RS, TITLE_PERCENTILE, TITLE_1M, TITLE_3M, TITLE_6M])
+        df = df_rs.copy()
+        breakpoints = {}
+        for column, rs_column in PERCENTILE_COLUMNS:
+            df[column], breakpoints[column] = pd.qcut(df[rs_column], 100, labels=False, retbins=True, duplicates="drop")
+        df = df.sort_values(([TITLE_RS]), ascending=False)
+        df[TITLE_RANK] = list(range(1, len(df)+1))
     dfs.append(df)
 
     # industries
-    def getDfView(industry_entry):
-        return industry_entry["info"]
-    def sum(a,b):
-        return a+b
-    def getRsAverage(industries, industry, column):
-        rs = reduce(sum, industries[industry][column])/len(industries[industry][column])
-        rs = int(rs*100) / 100 # round to 2 decimals
-        return rs
-    def rs_for_stock(ticker):
-        return stock_rs[ticker]
-    def getTickers(industries, industry):
-        return ",".join(sorted(industries[industry][TITLE_TICKERS], key=rs_for_stock, reverse=True))
-
-    # remove industries with only one stock
-    filtered_industries = filter(lambda i: len(i[TITLE_TICKERS]) > 1, list(industries.values()))
-    df_industries = pd.DataFrame(map(getDfView, filtered_industries), columns=[TITLE_RANK, TITLE_INDUSTRY, TITLE_SECTOR, TITLE_RS, TITLE_PERCENTILE, TITLE_1M, TITLE_3M, TITLE_6M])
-    df_industries[TITLE_RS] = df_industries.apply(lambda row: getRsAverage(industries, row[TITLE_INDUSTRY], TITLE_RS), axis=1)
-    df_industries[TITLE_1M] = df_industries.apply(lambda row: getRsAverage(industries, row[TITLE_INDUSTRY], TITLE_1M), axis=1)
-    df_industries[TITLE_3M] = df_industries.apply(lambda row: getRsAverage(industries, row[TITLE_INDUSTRY], TITLE_3M), axis=1)
-    df_industries[TITLE_6M] = df_industries.apply(lambda row: getRsAverage(industries, row[TITLE_INDUSTRY], TITLE_6M), axis=1)
-    df_industries[TITLE_PERCENTILE] = pd.qcut(df_industries[TITLE_RS], 100, labels=False, duplicates="drop")
-    df_industries[TITLE_1M] = pd.qcut(df_industries[TITLE_1M], 100, labels=False, duplicates="drop")
-    df_industries[TITLE_3M] = pd.qcut(df_industries[TITLE_3M], 100, labels=False, duplicates="drop")
-    df_industries[TITLE_6M] = pd.qcut(df_industries[TITLE_6M], 100, labels=False, duplicates="drop")
-    df_industries[TITLE_TICKERS] = df_industries.apply(lambda row: getTickers(industries, row[TITLE_INDUSTRY]), axis=1)
-    df_industries = df_industries.sort_values(([TITLE_RS]), ascending=False)
-    ind_ranks = ind_ranks[:len(df_industries)]
-    df_industries[TITLE_RANK] = ind_ranks
-
-    df_industries.to_csv(os.path.join(DIR, "output", f'rs_industries{suffix}.csv'), index = False)
+    with rs_metrics.stage("aggregation"):
+        df_industries = group_rankings(df_rs, TITLE_INDUSTRY, (TITLE_SECTOR,))
+        df_industries[TITLE_TICKERS] = df_industries[TITLE_INDUSTRY].map(ranked_members(df_rs, TITLE_INDUSTRY, TITLE_TICKER))
     dfs.append(df_industries)
 
+    # sectors
+    with rs_metrics.stage("aggregation"):
+        df_sectors = group_rankings(df_rs, TITLE_SECTOR)
+        # industries are already sorted by their relative strength
+        industries_by_sector = df_industries.groupby(TITLE_SECTOR, sort=False)[TITLE_INDUSTRY].agg(",".join)
+        df_sectors[TITLE_INDUSTRIES] = df_sectors[TITLE_SECTOR].map(industries_by_sector).fillna("")
+    dfs.append(df_sectors)
+    dfs.append(breakpoints)
+
     return dfs
 
+def write_breakpoints(breakpoints, reference = None):
+    """Saves the bin edges of the stock percentiles, so other series can be scored without ranking again (see `score`)"""
+    suffix = '' if reference in (None, REFERENCE_TICKER) else f'_{reference}'
+    np.savez(BREAKPOINTS_FILE % suffix, columns=np.array([column for column, _ in PERCENTILE_COLUMNS]), *[np.asarray(breakpoints[column], dtype=np.float64) for column, _ in PERCENTILE_COLUMNS])
+
+def read_breakpoints(reference = None):
+    """Returns the bin edges of the stock percentiles by percentile column"""
+    suffix = '' if reference in (None, REFERENCE_TICKER) else f'_{reference}'
+    with np.load(BREAKPOINTS_FILE % suffix) as data:
+        return {str(column): data[f'arr_{i}'] for i, column in enumerate(data["columns"])}
+
+def score(rs_row, breakpoints):
+    """Percentiles of relative strengths (now, 1M, 3M and 6M ago as in relative_strength_table) with a binary search in the breakpoints.
+    For stocks of the ranking these are the same percentiles that pd.qcut gave them, other values get the percentile of the bin they fall in."""
+    percentiles = {}
+    for (column, _), rs in zip(PERCENTILE_COLUMNS, rs_row):
+        edges = breakpoints[column]
+        # qcut bins are right closed and the first one includes its left edge
+        percentiles[column] = int(np.clip(np.searchsorted(edges, rs, side="left") - 1, 0, len(edges) - 2))
+    return percentiles
+
+def score_closes(closes_list, ref_closes, breakpoints):
+    """Relative strength and percentiles of each close series, compared to the closes of the reference"""
+    matrix = closes_matrix([ref_closes] + list(closes_list))
+    scores = []
+    for rs_row in relative_strength_table(matrix).tolist()[1:]:
+        scores.append({TITLE_RS: rs_row[0], **score(rs_row, breakpoints)})
+    return scores
+
+def backfill(days = BACKFILL_DAYS):
+    """Writes the relative strength and percentile of every ranked stock for each of the last `days` trading days.
+    The output has one row per day (dates of the reference ticker) and one column per ticker, percentile is -1 where a stock isn't ranked.
+    The closes of every stock are put on the days of the reference by their timestamps, so missing days don't shift a stock's history.
+    Days after the last candle of a stock aren't ranked."""
+    json = load_price_data(with_timestamps=True)
+    ref = json[REFERENCE_TICKER]
+    candidates = rankable_stocks(json)
+    days = min(days, len(ref["closes"]))
+    series = [ref] + [json[candidate[0]] for candidate in candidates]
+    axis = date_axis(ref["timestamps"], [entry["timestamps"] for entry in series], days - 1 + 4*QUARTER)
+    matrix = aligned_closes_matrix([entry["closes"] for entry in series], [entry["timestamps"] for entry in series], axis)
+    strength_all = rolling_strengths(matrix, days)
+    rs = (1 + strength_all[1:]) / (1 + strength_all[0]) * 100
+    rs = np.trunc(rs*100) / 100 # round to 2 decimals
+    # if rs is too big assume there is faulty price data
+    rs[~(rs < 600)] = np.nan
+    # rolling_strengths carries the last close forward, a stale stock would keep being ranked with it
+    valid = ~np.isnan(matrix[1:])
+    last = np.where(valid.any(axis=1), len(axis) - 1 - valid[:, ::-1].argmax(axis=1), -1)
+    rs[np.arange(len(axis) - days, len(axis))[None, :] > last[:, None]] = np.nan
+    rs = rs.T
+
+    percentiles = np.full(rs.shape, -1, dtype=np.int8)
+    for day in range(days):
+        ranked = ~np.isnan(rs[day])
+        if ranked.any():
+            percentiles[day, ranked] = pd.qcut(rs[day, ranked], 100, labels=False, duplicates="drop")
+
+    np.savez_compressed(
+        BACKFILL_FILE,
+        dates=np.asarray(ref["timestamps"][-days:], dtype=np.int64),
+        tickers=np.array([candidate[0] for candidate in candidates]),
+        rs=rs.astype(np.float32),
+        percentiles=percentiles
+    )
+    return rs, percentiles
+
+def read_backfill(file = None):
+    """Returns the backfill as two date x ticker dataframes: relative strength and percentile"""
+    with np.load(file or BACKFILL_FILE) as data:
+        index = pd.to_datetime(data["dates"], unit="s").date
+        df_rs = pd.DataFrame(data["rs"], index=index, columns=data["tickers"])
+        df_percentiles = pd.DataFrame(data["percentiles"], index=index, columns=data["tickers"])
+    return df_rs, df_percentiles
+
+
+def profiled(function, *args):
+    """Runs function under cProfile and writes the stats to PROFILE_FILE (view them with `python -m pstats`)"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(PROFILE_FILE)
+        print(f'Profile of the ranking written to {PROFILE_FILE}')
 
-def main(skipEnter = False):
-    ranks = rankings()
+def main(skipEnter = False, profile = False, price_data = None):
+    ranks = profiled(rankings, price_data) if profile else rankings(price_data)
+    rs_metrics.write_report()
     print(ranks[0])
     print("***\nYour 'rs_stocks.csv' is in the output folder.\n***")
     if not skipEnter and cfg("EXIT_WAIT_FOR_ENTER"):
         input("Press Enter key to exit...")
 
 if __name__ == "__main__":
-    main()
+    if "--backfill" in sys.argv:
+        backfill()
+        print(f'***\nYour \'{os.path.basename(BACKFILL_FILE)}\' is in the output folder.\n***')
+    else:
+        main(profile="--profile" in sys.argv)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Scores tickers or close series against the percentile breakpoints of the last ranking, without ranking again.
+
+    python rs_score.py AAPL NEWIPO          # closes from the price data, tickers that aren't in it are loaded from yahoo
+    python rs_score.py --closes series.csv  # a close series, one close per row (or a "Close" column)
+    python rs_score.py --reference QQQ AAPL
+"""
+import argparse
+import datetime as dt
+from datetime import date
+import pandas as pd
+import rs_ranking
+
+def load_closes(tickers, price_data):
+    """Closes of the tickers, from the price data or from yahoo"""
+    closes = {}
+    missing = [ticker for ticker in tickers if ticker not in price_data or "closes" not in price_data[ticker]]
+    for ticker in tickers:
+        if ticker not in missing:
+            closes[ticker] = price_data[ticker]["closes"]
+    if missing:
+        # imported here as it is slow to import and only needed for unknown tickers
+        import rs_data
+        today = date.today()
+        for ticker in missing:
+            security = {"ticker": ticker, "sector": "n/a", "industry": "n/a", "universe": "n/a"}
+            candles = rs_data.get_yf_data(security, today - dt.timedelta(days=rs_data.HISTORY_DAYS), today)["candles"]
+            closes[ticker] = [candle["close"] for candle in candles]
+    return closes
+
+def read_closes_file(file):
+    df = pd.read_csv(file)
+    for column in ("Close", "close"):
+        if column in df.columns:
+            return df[column].dropna().tolist()
+    # no header: the first column holds the closes
+    df = pd.read_csv(file, header=None)
+    return df[0].dropna().tolist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Scores tickers or close series against the last ranking")
+    parser.add_argument("tickers", nargs="*")
+    parser.add_argument("--closes", nargs="+", default=[], metavar="FILE", help="csv file with a close series")
+    parser.add_argument("--reference", default=rs_ranking.REFERENCE_TICKER)
+    args = parser.parse_args()
+
+    breakpoints = rs_ranking.read_breakpoints(args.reference)
+    price_data = rs_ranking.load_price_data()
+    closes = load_closes([ticker.upper() for ticker in args.tickers], price_data)
+    for file in args.closes:
+        closes[file] = read_closes_file(file)
+    scores = rs_ranking.score_closes(closes.values(), price_data[args.reference]["closes"], breakpoints)
+    df = pd.DataFrame(scores, index=list(closes))
+    print(df)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Keeps the rankings of all stocks in memory and answers queries over HTTP/JSON.
+The rankings are calculated again when rs_data.py has written new price data.
+
+    python rs_service.py [port]
+
+    GET /status
+    GET /tickers/<ticker>
+    GET /top?n=50
+    GET /industries                GET /industries/<industry>
+    GET /sectors                   GET /sectors/<sector>
+    GET /percentiles?min=80&max=99
+
+Every query takes `reference=<ticker>` to use another ticker of REFERENCE_TICKERS.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+import numpy as np
+from rs_config import cfg
+import rs_ranking
+import rs_store
+
+SERVICE_PORT = cfg("SERVICE_PORT") or 8765
+SERVICE_RELOAD_SECONDS = cfg("SERVICE_RELOAD_SECONDS") or 10
+DEFAULT_TOP = 50
+
+_lock = threading.Lock()
+_state = {"panel": None, "mtime": None, "loaded": None}
+
+def build_panel(ranks):
+    """Indexes the ranked stocks, industries and sectors of every reference for the queries"""
+    panel = {}
+    for reference, (df, df_industries, df_sectors, breakpoints) in ranks.items():
+        stocks = df.to_dict("records")
+        members = {rs_ranking.TITLE_INDUSTRY: {}, rs_ranking.TITLE_SECTOR: {}}
+        for stock in stocks:
+            for key, groups in members.items():
+                groups.setdefault(stock[key], []).append(stock)
+        panel[reference] = {
+            "stocks": stocks,
+            "by_ticker": {stock[rs_ranking.TITLE_TICKER]: stock for stock in stocks},
+            # stocks are sorted by relative strength, so the negated percentiles are ascending
+            "negated_percentiles": -df[rs_ranking.TITLE_PERCENTILE].to_numpy(),
+            "groups": {
+                rs_ranking.TITLE_INDUSTRY: df_industries.to_dict("records"),
+                rs_ranking.TITLE_SECTOR: df_sectors.to_dict("records")
+            },
+            "members": members
+        }
+    return panel
+
+def query_ticker(ranked, ticker):
+    return ranked["by_ticker"].get(ticker.upper())
+
+def query_top(ranked, n):
+    return ranked["stocks"][:n]
+
+def query_percentiles(ranked, low, high):
+    """Stocks with low <= percentile <= high, strongest first"""
+    start = np.searchsorted(ranked["negated_percentiles"], -high, side="left")
+    end = np.searchsorted(ranked["negated_percentiles"], -low, side="right")
+    return ranked["stocks"][start:end]
+
+def query_groups(ranked, key):
+    return ranked["groups"][key]
+
+def query_group(ranked, key, name):
+    """The industry or sector with its stocks, strongest first"""
+    for group in ranked["groups"][key]:
+        if group[key] == name:
+            return {**group, "Stocks": ranked["members"][key].get(name, [])}
+    return None
+
+def price_data_mtime():
+    if rs_ranking.PRICE_STORE == "BINARY":
+        file = os.path.join(rs_store.PRICE_STORE_DIR, rs_store.META_FILE)
+    else:
+        file = rs_ranking.PRICE_DATA
+    try:
+        return os.path.getmtime(file)
+    except FileNotFoundError:
+        return None
+
+def reload():
+    """Ranks all stocks again and swaps in the new panel, queries keep using the old one until it is ready"""
+    mtime = price_data_mtime()
+    start = time.time()
+    panel = build_panel(rs_ranking.rank_all())
+    with _lock:
+        _state["panel"] = panel
+        _state["mtime"] = mtime
+        _state["loaded"] = datetime.now().isoformat()
+    print(f'Ranked {sum(len(ranked["stocks"]) for ranked in panel.values())} stocks in {time.time() - start:.1f}s.')
+
+def watch(interval_s):
+    """Reloads when the price data changed and hasn't been touched for interval_s, i.e. rs_data.py is done writing it"""
+    while True:
+        time.sleep(interval_s)
+        mtime = price_data_mtime()
+        if mtime is None or mtime == _state["mtime"] or time.time() - mtime < interval_s:
+            continue
+        try:
+            reload()
+        except Exception as e:
+            print(f'Reload failed, keeping the previous rankings: {e}')
+
+def to_json(value):
+    # numpy scalars that pandas leaves in the records
+    return json.dumps(value, default=lambda o: o.item() if hasattr(o, "item") else str(o)).encode()
+
+class RankingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = to_json(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        with _lock:
+            panel = _state["panel"]
+            status = {"loaded": _state["loaded"], "references": list(panel), "stocks": {reference: len(ranked["stocks"]) for reference, ranked in panel.items()}}
+        ranked = panel.get(params.get("reference", rs_ranking.REFERENCE_TICKER))
+        if ranked is None:
+            return self.send_json(404, {"error": f'unknown reference, use one of {",".join(panel)}'})
+        try:
+            result = self.route(ranked, parts, params, status)
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+        if result is None:
+            return self.send_json(404, {"error": "not found"})
+        self.send_json(200, result)
+
+    def route(self, ranked, parts, params, status):
+        groups = {"industries": rs_ranking.TITLE_INDUSTRY, "sectors": rs_ranking.TITLE_SECTOR}
+        if parts == ["status"]:
+            return status
+        if len(parts) == 2 and parts[0] == "tickers":
+            return query_ticker(ranked, parts[1])
+        if parts == ["top"]:
+            return query_top(ranked, int(params.get("n", DEFAULT_TOP)))
+        if parts == ["percentiles"]:
+            return query_percentiles(ranked, int(params.get("min", 0)), int(params.get("max", 99)))
+        if len(parts) == 1 and parts[0] in groups:
+            return query_groups(ranked, groups[parts[0]])
+        if len(parts) == 2 and parts[0] in groups:
+            return query_group(ranked, groups[parts[0]], parts[1])
+        return None
+
+def serve(port = None, reload_s = None):
+    port = port or SERVICE_PORT
+    reload()
+    threading.Thread(target=watch, args=(reload_s or SERVICE_RELOAD_SECONDS,), daemon=True).start()
+    server = ThreadingHTTPServer(("127.0.0.1", port), RankingHandler)
+    server.daemon_threads = True
+    print(f'Serving the rankings on http://127.0.0.1:{server.server_address[1]}')
+    server.serve_forever()
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import sys
+import numpy as np
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+PRICE_STORE_DIR = os.path.join(DIR, "data", "price_store")
+PRICE_DATA_FILE = os.path.join(DIR, "data", "price_history.json")
+FIELDS = ("open", "close", "low", "high", "volume")
+META_FIELDS = ("sector", "industry", "universe")
+META_FILE = "meta.json"
+
+def timestamp_seconds(timestamp):
+    """TDA timestamps are in milliseconds, yahoo timestamps in seconds"""
+    return timestamp // 1000 if timestamp > 10**11 else timestamp
+
+def _empty_arrays():
+    meta = {"tickers": []}
+    for field in META_FIELDS:
+        meta[field] = []
+    return {"meta": meta, "counts": [], "columns": {field: [] for field in FIELDS}, "timestamps": []}
+
+def _add_ticker(arrays, ticker, ticker_data):
+    arrays["meta"]["tickers"].append(ticker)
+    for field in META_FIELDS:
+        arrays["meta"][field].append(ticker_data.get(field))
+    candles = ticker_data.get("candles") or []
+    arrays["counts"].append(len(candles))
+    for field in FIELDS:
+        arrays["columns"][field].append(np.array([candle[field] for candle in candles], dtype=np.float64))
+    arrays["timestamps"].append(np.array([timestamp_seconds(candle["datetime"]) for candle in candles], dtype=np.int64))
+
+def write_price_store(tickers, path = None):
+    """Writes the price history (a dict or (ticker, ticker_data) pairs) as one array per field. Rows of all tickers are concatenated,
+    offsets[i]:offsets[i+1] are the rows of the i-th ticker and date_index points into the shared dates."""
+    items = tickers.items() if isinstance(tickers, dict) else tickers
+    arrays = _empty_arrays()
+    for ticker, ticker_data in items:
+        _add_ticker(arrays, ticker, ticker_data)
+    _write_arrays(arrays, path or PRICE_STORE_DIR)
+
+def _copy_ticker(arrays, store, i):
+    ticker = store["tickers"][i]
+    rows = ticker_rows(store, ticker)
+    arrays["meta"]["tickers"].append(ticker)
+    for field in META_FIELDS:
+        arrays["meta"][field].append(store[field][i])
+    arrays["counts"].append(rows.stop - rows.start)
+    for field in FIELDS:
+        arrays["columns"][field].append(np.array(store[field][rows]))
+    arrays["timestamps"].append(np.array(ticker_timestamps(store, ticker)))
+
+def replace_tickers(replacements, path = None):
+    """Replaces the stored data of the tickers in replacements (ticker_data by ticker), all other tickers are copied as arrays.
+    Tickers that aren't stored yet are added at the end."""
+    path = path or PRICE_STORE_DIR
+    store = read_price_store(path)
+    arrays = _empty_arrays()
+    for i, ticker in enumerate(store["tickers"]):
+        if ticker in replacements:
+            _add_ticker(arrays, ticker, replacements[ticker])
+        else:
+            _copy_ticker(arrays, store, i)
+    for ticker, ticker_data in replacements.items():
+        if ticker not in store["index"]:
+            _add_ticker(arrays, ticker, ticker_data)
+    # close the memory maps before the store is replaced
+    del store
+    _write_arrays(arrays, path)
+
+def merge_price_stores(paths, path = None, order = None):
+    """Combines the stores in paths into one, copying the arrays. A ticker that is in several stores is taken from the last one.
+    Tickers are sorted like in order (a list of tickers) where given, the others follow in the order of the stores."""
+    location = {}
+    for store in [read_price_store(store_path) for store_path in paths]:
+        for i, ticker in enumerate(store["tickers"]):
+            location[ticker] = (store, i)
+    tickers = list(location)
+    if order:
+        position = {ticker: i for i, ticker in enumerate(order)}
+        tickers.sort(key=lambda ticker: position.get(ticker, len(position)))
+    arrays = _empty_arrays()
+    for ticker in tickers:
+        _copy_ticker(arrays, *location[ticker])
+    # close the memory maps before the store is written
+    del location
+    _write_arrays(arrays, path or PRICE_STORE_DIR)
+    return len(tickers)
+
+def _write_arrays(arrays, path):
+    meta = arrays["meta"]
+    counts = arrays["counts"]
+    columns = arrays["columns"]
+    timestamps = arrays["timestamps"]
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    all_timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0, dtype=np.int64)
+    dates, date_index = np.unique(all_timestamps, return_inverse=True)
+
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_path, "dates.npy"), dates.astype(np.int64))
+    np.save(os.path.join(tmp_path, "date_index.npy"), date_index.astype(np.int32))
+    for field in FIELDS:
+        values = np.concatenate(columns[field]) if columns[field] else np.zeros(0)
+        np.save(os.path.join(tmp_path, f'{field}.npy'), values)
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf8") as fp:
+        json.dump(meta, fp, ensure_ascii=False)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+def price_store_exists(path = None):
+    return os.path.exists(os.path.join(path or PRICE_STORE_DIR, META_FILE))
+
+def read_price_store(path = None):
+    """Opens the price store. The arrays are memory-mapped, so only the rows that are used are read from disk."""
+    path = path or PRICE_STORE_DIR
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as fp:
+        store = json.load(fp)
+    for name in ("offsets", "dates", "date_index") + FIELDS:
+        store[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode="r")
+    store["index"] = {ticker: i for i, ticker in enumerate(store["tickers"])}
+    return store
+
+def ticker_rows(store, ticker):
+    i = store["index"][ticker]
+    return slice(int(store["offsets"][i]), int(store["offsets"][i+1]))
+
+def ticker_closes(store, ticker):
+    return store["close"][ticker_rows(store, ticker)]
+
+def ticker_timestamps(store, ticker):
+    return store["dates"][store["date_index"][ticker_rows(store, ticker)]]
+
+def ticker_candles(store, ticker):
+    """Candles of ticker in the price_history.json format"""
+    rows = ticker_rows(store, ticker)
+    columns = [store[field][rows].tolist() for field in FIELDS]
+    columns.append(ticker_timestamps(store, ticker).tolist())
+    keys = FIELDS + ("datetime",)
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+def store_to_dict(store):
+    """Converts the store back to the price_history.json format"""
+    tickers_dict = {}
+    for i, ticker in enumerate(store["tickers"]):
+        ticker_data = {"candles": ticker_candles(store, ticker)}
+        for field in META_FIELDS:
+            ticker_data[field] = store[field][i]
+        tickers_dict[ticker] = ticker_data
+    return tickers_dict
+
+def import_json(json_file = PRICE_DATA_FILE, path = None):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        write_price_store(json.load(fp), path)
+
+def export_json(json_file = PRICE_DATA_FILE, path = None):
+    with open(json_file, "w", encoding="utf8") as fp:
+        json.dump(store_to_dict(read_price_store(path)), fp, ensure_ascii=False)
+
+def main():
+    command = None if len(sys.argv) <= 1 else sys.argv[1]
+    json_file = PRICE_DATA_FILE if len(sys.argv) <= 2 else sys.argv[2]
+    if command == "import":
+        import_json(json_file)
+        print(f'Imported {json_file} into {PRICE_STORE_DIR}')
+    elif command == "export":
+        export_json(json_file)
+        print(f'Exported {PRICE_STORE_DIR} to {json_file}')
+    else:
+        print("Usage: rs_store.py import|export [price_history.json]")
+
+if __name__ == "__main__":
+    main()
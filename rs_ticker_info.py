@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+TICKER_INFO_FILE = os.path.join(DIR, "data_persist", "ticker_info.json")
+TICKER_INFO_DB = os.path.join(DIR, "data_persist", "ticker_info.db")
+NOT_AVAILABLE = "n/a"
+DAY_S = 24*60*60
+# infos are looked up in chunks to stay below sqlite's variable limit
+QUERY_CHUNK = 500
+COMMIT_EVERY = 25
+
+_connections = {}
+_lock = threading.Lock()
+
+def connect(path = None, seed_file = None):
+    """Opens the ticker info cache. A new cache is filled with the entries of ticker_info.json."""
+    path = path or TICKER_INFO_DB
+    seed_file = seed_file or TICKER_INFO_FILE
+    with _lock:
+        if path in _connections:
+            return _connections[path]
+        con = sqlite3.connect(path, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS ticker_info (
+            ticker TEXT PRIMARY KEY,
+            industry TEXT NOT NULL,
+            sector TEXT NOT NULL,
+            failed INTEGER NOT NULL,
+            updated REAL NOT NULL
+        )""")
+        if con.execute("SELECT COUNT(*) FROM ticker_info").fetchone()[0] == 0 and os.path.exists(seed_file):
+            seed(con, seed_file)
+        _connections[path] = con
+        return con
+
+def seed(con, seed_file):
+    """Failed entries are seeded as expired, so they are tried again. Entries of files without update times count as updated now."""
+    with open(seed_file, "r", encoding="utf-8") as fp:
+        info_dict = json.load(fp)
+    now = time.time()
+    rows = []
+    for ticker, entry in info_dict.items():
+        industry = entry["info"]["industry"]
+        sector = entry["info"]["sector"]
+        failed = is_failed(industry, sector)
+        rows.append((ticker, industry, sector, int(failed), 0 if failed else entry.get("updated", now)))
+    con.executemany("INSERT OR REPLACE INTO ticker_info VALUES (?, ?, ?, ?, ?)", rows)
+    con.commit()
+
+def is_failed(industry, sector):
+    return industry == NOT_AVAILABLE and sector == NOT_AVAILABLE
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+def _rows(con, tickers, columns):
+    for chunk in _chunks(list(tickers), QUERY_CHUNK):
+        placeholders = ",".join("?" * len(chunk))
+        yield from con.execute(f'SELECT ticker, {columns} FROM ticker_info WHERE ticker IN ({placeholders})', chunk)
+
+def get_ticker_infos(tickers, con = None):
+    """Returns {"industry", "sector"} by ticker for the requested tickers that are in the cache"""
+    con = con or connect()
+    return {ticker: {"industry": industry, "sector": sector} for ticker, industry, sector in _rows(con, tickers, "industry, sector")}
+
+def stale_tickers(tickers, ttl_days, failed_ttl_days, con = None, now = None):
+    """Returns the tickers that are not cached yet or whose entry expired. Failed lookups expire after failed_ttl_days."""
+    con = con or connect()
+    now = now or time.time()
+    updated = {ticker: (failed, updated) for ticker, failed, updated in _rows(con, tickers, "failed, updated")}
+    stale = []
+    for ticker in tickers:
+        if ticker not in updated:
+            stale.append(ticker)
+            continue
+        failed, updated_at = updated[ticker]
+        ttl_s = (failed_ttl_days if failed else ttl_days) * DAY_S
+        if now - updated_at > ttl_s:
+            stale.append(ticker)
+    return stale
+
+def fetch_ticker_info(ticker):
+    """Loads industry and sector from yahoo finance. Missing values are n/a."""
+    # imported here as it is slow to import and only needed when loading
+    import yfinance as yf
+    try:
+        info = yf.Ticker(ticker.replace(".", "-")).info
+    except Exception:
+        info = {}
+    return info.get("industry") or NOT_AVAILABLE, info.get("sector") or NOT_AVAILABLE
+
+def refresh(tickers, workers, ttl_days, failed_ttl_days, con = None):
+    """Loads the infos of all stale tickers with `workers` requests in flight and writes them to the cache as they arrive"""
+    con = con or connect()
+    stale = stale_tickers(tickers, ttl_days, failed_ttl_days, con)
+    if len(stale) == 0:
+        return 0
+    print(f'*** Loading info of {len(stale)} tickers ***')
+    failed_count = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(fetch_ticker_info, ticker): ticker for ticker in stale}
+        for idx, future in enumerate(as_completed(futures)):
+            industry, sector = future.result()
+            failed = is_failed(industry, sector)
+            failed_count = failed_count + failed
+            con.execute("INSERT OR REPLACE INTO ticker_info VALUES (?, ?, ?, ?, ?)", (futures[future], industry, sector, int(failed), time.time()))
+            if (idx + 1) % COMMIT_EVERY == 0:
+                con.commit()
+    con.commit()
+    print(f'Loaded info of {len(stale)} tickers, {failed_count} without info.')
+    return len(stale)
+
+def export_json(json_file = None, con = None):
+    """Writes the cache in the ticker_info.json format, with the update times so a new cache seeded from it keeps the TTLs"""
+    json_file = json_file or TICKER_INFO_FILE
+    con = con or connect()
+    info_dict = {}
+    for ticker, industry, sector, updated in con.execute("SELECT ticker, industry, sector, updated FROM ticker_info ORDER BY ticker"):
+        info_dict[ticker] = {"info": {"industry": industry, "sector": sector}, "updated": updated}
+    with open(json_file, "w", encoding="utf8") as fp:
+        json.dump(info_dict, fp, ensure_ascii=False)
+
+def main():
+    command = None if len(sys.argv) <= 1 else sys.argv[1]
+    if command == "export":
+        json_file = TICKER_INFO_FILE if len(sys.argv) <= 2 else sys.argv[2]
+        export_json(json_file)
+        print(f'Exported {TICKER_INFO_DB} to {json_file}')
+    else:
+        print("Usage: rs_ticker_info.py export [ticker_info.json]")
+
+if __name__ == "__main__":
+    main()